@@ -3,9 +3,9 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Sum
+from django.db.models import Count, Sum
 from orders.models import Order
-from cart.views import get_or_create_cart  # Import your cart function
+from cart.models import CartItem, cart_summary
 from decimal import Decimal
 
 def register(request):
@@ -58,8 +58,7 @@ def profile(request):
     # Get cart items count using your cart system
     cart_items = 0
     try:
-        cart = get_or_create_cart(request)
-        cart_items = cart.total_items  # Uses the @property from your Cart model
+        cart_items = cart_summary(CartItem.objects.filter(cart__user=user))['items']
     except Exception as e:
         # Fallback: try session-based cart
         try:
@@ -82,7 +81,7 @@ def profile(request):
         # Fix the decimal formatting - round to 2 decimal places
         total_spent = total_spent.quantize(Decimal('0.01'))
         
-        recent_orders = user_orders.order_by('-created_at')[:5]  # Show all recent orders regardless of status
+        recent_orders = user_orders.annotate(item_count=Count('items')).order_by('-created_at')[:5]  # Show all recent orders regardless of status
         
     except Exception as e:
         # Fallback if Order model doesn't exist or has issues
@@ -0,0 +1,185 @@
+"""
+Cart for anonymous visitors, kept in a signed cookie.
+
+Visitors who aren't logged in never get a session or Cart/CartItem rows:
+their lines ({product id: quantity}) and the last computed summary live in
+a compressed, signed cookie that AnonymousCartMiddleware writes back when
+the cart changes. On login (or register) the lines are merged into the
+user's Cart in bulk and the cookie is dropped.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import F
+
+from products.cache import catalog_version
+from products.models import Product
+
+from .models import CartItem
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'cart.anonymous'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Keeps the cookie well under the 4KB browsers accept
+MAX_LINES = 50
+
+
+class AnonymousCartItem:
+    """Quacks like a CartItem for templates; `id` is the product id"""
+
+    def __init__(self, product, quantity):
+        self.id = product.id
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def total_price(self):
+        return self.product.effective_price * self.quantity
+
+
+class AnonymousCart:
+
+    def __init__(self, lines=None, summary=None):
+        self.lines = dict(lines or {})
+        self._stored_summary = summary
+        self.modified = False
+
+    @classmethod
+    def from_request(cls, request):
+        value = request.COOKIES.get(COOKIE_NAME)
+        if not value:
+            return cls()
+        try:
+            data = signing.loads(value, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+            lines = {int(product_id): int(quantity) for product_id, quantity in data['l']}
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            cart = cls()
+            cart.modified = True  # overwrite the bad cookie
+            return cart
+        if any(quantity < 1 for quantity in lines.values()):
+            # Written before quantities were checked; drop those lines
+            cart = cls({product_id: quantity for product_id, quantity in lines.items() if quantity >= 1})
+            cart.modified = True
+            return cart
+        return cls(lines, data.get('s'))
+
+    def dumps(self):
+        return signing.dumps(
+            {'l': [[product_id, quantity] for product_id, quantity in self.lines.items()],
+             's': self._stored_summary},
+            salt=COOKIE_SALT,
+            compress=True,
+        )
+
+    def _changed(self):
+        self._stored_summary = None
+        self.modified = True
+
+    def add(self, product_id, quantity):
+        if quantity < 1:
+            raise ValueError('quantity must be at least 1')
+        if product_id not in self.lines and len(self.lines) >= MAX_LINES:
+            return False
+        self.lines[product_id] = self.lines.get(product_id, 0) + quantity
+        self._changed()
+        return True
+
+    def set(self, product_id, quantity):
+        if product_id not in self.lines:
+            return False
+        if quantity > 0:
+            self.lines[product_id] = quantity
+        else:
+            del self.lines[product_id]
+        self._changed()
+        return True
+
+    def remove(self, product_id):
+        return self.set(product_id, 0)
+
+    def clear(self):
+        self.lines = {}
+        self._changed()
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def items(self):
+        products = Product.objects.filter(id__in=self.lines, is_active=True).select_related('category')
+        return [AnonymousCartItem(product, self.lines[product.id]) for product in products]
+
+    def summary(self):
+        """{'items', 'total'}; prices are re-read only when the catalog version moved"""
+        if not self.lines:
+            return {'items': 0, 'total': Decimal('0.00')}
+        version = catalog_version()
+        stored = self._stored_summary
+        if stored and stored[2] == version:
+            return {'items': stored[0], 'total': Decimal(stored[1])}
+        prices = dict(Product.objects.filter(id__in=self.lines, is_active=True).values_list('id', 'effective_price'))
+        items = sum(quantity for product_id, quantity in self.lines.items() if product_id in prices)
+        total = sum((prices[product_id] * quantity for product_id, quantity in self.lines.items()
+                     if product_id in prices), Decimal('0')).quantize(Decimal('0.01'))
+        self._stored_summary = [items, str(total), version]
+        self.modified = True
+        return {'items': items, 'total': total}
+
+    @property
+    def total_items(self):
+        return self.summary()['items']
+
+    @property
+    def total_price(self):
+        return self.summary()['total']
+
+
+def anonymous_cart(request):
+    """The visitor's AnonymousCart, loaded from the cookie once per request"""
+    if not hasattr(request, '_anonymous_cart'):
+        request._anonymous_cart = AnonymousCart.from_request(request)
+    return request._anonymous_cart
+
+
+def merge_into(cart, lines):
+    """Add {product id: quantity} to a Cart with one read and two bulk writes"""
+    lines = {product_id: quantity for product_id, quantity in lines.items() if quantity >= 1}
+    product_ids = set(Product.objects.filter(id__in=lines, is_active=True).values_list('id', flat=True))
+    with transaction.atomic():
+        existing = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(cart=cart, product_id__in=product_ids)
+        }
+        for product_id, item in existing.items():
+            item.quantity = F('quantity') + lines[product_id]
+        CartItem.objects.bulk_update(existing.values(), ['quantity'])
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_id=product_id, quantity=lines[product_id])
+             for product_id in product_ids if product_id not in existing],
+            ignore_conflicts=True,
+        )
+
+
+class AnonymousCartMiddleware:
+    """Write the anonymous cart cookie back when a view changed it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        visitor_cart = getattr(request, '_anonymous_cart', None)
+        if visitor_cart is not None and visitor_cart.modified:
+            if visitor_cart:
+                response.set_cookie(
+                    COOKIE_NAME,
+                    visitor_cart.dumps(),
+                    max_age=COOKIE_MAX_AGE,
+                    secure=settings.SESSION_COOKIE_SECURE,
+                    httponly=True,
+                    samesite='Lax',
+                )
+            else:
+                response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        return response
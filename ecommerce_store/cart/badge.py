@@ -0,0 +1,46 @@
+"""
+Cart summary cached in the session for the header badge.
+
+The context processor runs on every page, so it reads the item count and
+total from the session instead of the database. The cart views (and
+checkout) store a fresh summary whenever they change the cart. Each entry
+records the owner it was computed for and the catalog version at the time,
+so logging in as someone else, or a price change, forces one recomputation.
+Anonymous visitors have no session; their summary rides in the cart cookie.
+"""
+from decimal import Decimal
+
+from products.cache import catalog_version
+
+from .anonymous import anonymous_cart
+from .models import CartItem, cart_summary
+
+SESSION_KEY = 'cart_summary'
+
+
+def remember(request, summary):
+    """Store a cart summary for the rest of the request (and the session)"""
+    if request.user.is_authenticated:
+        request.session[SESSION_KEY] = {
+            'items': summary['items'],
+            'total': str(summary['total']),
+            'owner': request.user.pk,
+            'version': catalog_version(),
+        }
+    request._cart_badge = {'cart_items': summary['items'], 'cart_total': summary['total']}
+
+
+def recompute(request):
+    summary = cart_summary(CartItem.objects.filter(cart__user=request.user))
+    remember(request, summary)
+    return summary
+
+
+def session_summary(request):
+    """{'items', 'total'} from the session or cookie, recomputed only when stale"""
+    if not request.user.is_authenticated:
+        return anonymous_cart(request).summary()
+    stored = request.session.get(SESSION_KEY)
+    if stored and stored['owner'] == request.user.pk and stored['version'] == catalog_version():
+        return {'items': stored['items'], 'total': Decimal(stored['total'])}
+    return recompute(request)
@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = 'Delete anonymous carts whose session has expired or that have been idle for N days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Idle days before a cart is abandoned')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Carts deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between chunks')
+        parser.add_argument('--dry-run', action='store_true', help='Count what would be deleted')
+
+    def abandoned_carts(self, days):
+        now = timezone.now()
+        cutoff = now - timedelta(days=days)
+        # Adding items doesn't touch the cart row, so a recent item keeps it alive
+        idle = Q(updated_at__lt=cutoff) & ~Exists(
+            CartItem.objects.filter(cart=OuterRef('pk'), created_at__gte=cutoff)
+        )
+        condition = idle
+        if settings.SESSION_ENGINE == 'django.contrib.sessions.backends.db':
+            condition |= ~Exists(Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gt=now))
+        return Cart.objects.filter(Q(user__isnull=True) & condition)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        carts = self.abandoned_carts(options['days'])
+
+        if options['dry_run']:
+            cart_count = carts.count()
+            item_count = CartItem.objects.filter(cart__in=carts).count()
+            self.stdout.write(f'Would delete {cart_count} carts and {item_count} cart items')
+            return
+
+        # Walk the candidates in primary-key chunks so each transaction (and
+        # the locks it holds) stays small
+        deleted_carts = deleted_items = 0
+        last_pk = 0
+        while True:
+            chunk = list(
+                carts.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['chunk_size']]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1]
+            with transaction.atomic():
+                deleted_items += CartItem.objects.filter(cart_id__in=chunk).delete()[0]
+                deleted_carts += Cart.objects.filter(pk__in=chunk).delete()[0]
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  up to cart {last_pk}: {deleted_carts} carts, {deleted_items} items')
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        elapsed = time.monotonic() - started
+        rate = deleted_carts / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted_carts} carts and {deleted_items} cart items in {elapsed:.1f}s ({rate:.0f} carts/s)'
+        ))
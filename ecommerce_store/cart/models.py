@@ -1,7 +1,23 @@
-from django.db import models
+from decimal import Decimal
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
 from django.contrib.auth.models import User
 from products.models import Product
 
+
+def cart_summary(items):
+    """Item count and total for a CartItem queryset, in one aggregate query"""
+    summary = items.aggregate(
+        items=Sum('quantity'),
+        total=Sum(F('quantity') * F('product__effective_price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    )
+    return {
+        'items': summary['items'] or 0,
+        'total': (summary['total'] or Decimal('0')).quantize(Decimal('0.01')),
+    }
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
     session_key = models.CharField(max_length=50, null=True, blank=True)
@@ -11,13 +27,47 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart - {self.user or self.session_key}"
 
+    def summary(self):
+        """Recompute (and remember) the item count and total for this cart"""
+        self._summary = cart_summary(self.items.all())
+        return self._summary
+
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return (getattr(self, '_summary', None) or self.summary())['total']
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return (getattr(self, '_summary', None) or self.summary())['items']
+
+class CartItemManager(models.Manager):
+
+    def add_quantity(self, cart, product_id, quantity):
+        """
+        Add quantity to the cart's line for product_id, creating it if needed,
+        as one atomic statement. ON CONFLICT needs SQLite 3.24, below Django's
+        own minimum.
+        """
+        if connection.vendor in ('sqlite', 'postgresql'):
+            table = connection.ops.quote_name(self.model._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (cart_id, product_id, quantity, created_at) VALUES (%s, %s, %s, %s) '
+                    f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity',
+                    [cart.pk, product_id, quantity, connection.ops.adapt_datetimefield_value(timezone.now())],
+                )
+            return
+
+        # Other backends: increment in place, insert if there was nothing to
+        # increment, and retry the increment if a concurrent insert won
+        lines = self.filter(cart=cart, product_id=product_id)
+        if not lines.update(quantity=F('quantity') + quantity):
+            try:
+                with transaction.atomic():
+                    self.create(cart=cart, product_id=product_id, quantity=quantity)
+            except IntegrityError:
+                lines.update(quantity=F('quantity') + quantity)
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -25,6 +75,8 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = ('cart', 'product')
 
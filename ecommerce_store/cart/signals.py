@@ -0,0 +1,17 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .anonymous import anonymous_cart, merge_into
+from .models import Cart
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    if request is None:
+        return
+    visitor_cart = anonymous_cart(request)
+    if not visitor_cart:
+        return
+    cart, created = Cart.objects.get_or_create(user=user)
+    merge_into(cart, visitor_cart.lines)
+    visitor_cart.clear()
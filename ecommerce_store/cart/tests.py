@@ -1,3 +1,341 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+
+from orders.models import StockReservation
+from products.cache import bump_catalog_version
+from products.models import Product
+from products.testing import CatalogTestCase, CatalogTransactionTestCase, make_product
+
+from .anonymous import COOKIE_NAME, COOKIE_SALT, AnonymousCart
+from .badge import session_summary
+from .models import Cart, CartItem
+
+
+def make_products(*prices, stock=10):
+    return [
+        make_product(f'Shoe {i}', f'SHOE-{i}', price=price, discount_price=discount, stock_quantity=stock)
+        for i, (price, discount) in enumerate(prices)
+    ]
+
+
+class CartSummaryTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.plain, cls.sale = make_products((Decimal('100.00'), None), (Decimal('50.00'), Decimal('19.99')))
+
+    def test_empty_cart(self):
+        self.assertEqual(self.cart.summary(), {'items': 0, 'total': Decimal('0.00')})
+
+    def test_summary_is_one_query_at_the_price_customers_pay(self):
+        CartItem.objects.create(cart=self.cart, product=self.plain, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.sale, quantity=3)
+        cart = Cart.objects.get(pk=self.cart.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.summary(), {'items': 5, 'total': Decimal('259.97')})
+            # The properties reuse the computed summary
+            self.assertEqual((cart.total_items, cart.total_price), (5, Decimal('259.97')))
+
+
+class CartBadgeTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret')
+        cls.other = User.objects.create_user('other', password='secret')
+        cart = Cart.objects.create(user=cls.user)
+        cls.product, = make_products((Decimal('10.00'), None))
+        CartItem.objects.create(cart=cart, product=cls.product, quantity=2)
+
+    def setUp(self):
+        super().setUp()
+        self.session = SessionStore()
+
+    def summary(self, user):
+        request = RequestFactory().get('/')
+        request.user, request.session = user, self.session
+        return session_summary(request)
+
+    def test_summary_is_served_from_the_session(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.summary(self.user), {'items': 2, 'total': Decimal('20.00')})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.summary(self.user), {'items': 2, 'total': Decimal('20.00')})
+
+    def test_price_changes_and_other_users_force_a_recompute(self):
+        self.summary(self.user)
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('15.00'))
+        bump_catalog_version()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.summary(self.user)['total'], Decimal('30.00'))
+        # Same session, different user (e.g. logged in as someone else)
+        self.assertEqual(self.summary(self.other), {'items': 0, 'total': Decimal('0.00')})
+
+    def test_cart_views_store_a_fresh_summary(self):
+        self.client.force_login(self.user)
+        self.client.post('/cart/add/', {'product_id': self.product.pk, 'quantity': 3})
+        self.assertEqual(self.client.session['cart_summary']['items'], 5)
+        self.assertEqual(self.client.session['cart_summary']['total'], '50.00')
+
+
+class AnonymousCartTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoe, cls.boot = make_products((Decimal('10.00'), None), (Decimal('25.00'), None))
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def lines(self, response):
+        return dict(signing.loads(response.cookies[COOKIE_NAME].value, salt=COOKIE_SALT)['l'])
+
+    def set_cookie(self, lines):
+        self.client.cookies[COOKIE_NAME] = signing.dumps(
+            {'l': [[product_id, quantity] for product_id, quantity in lines.items()], 's': None},
+            salt=COOKIE_SALT, compress=True,
+        )
+
+    def test_cart_lives_in_the_cookie(self):
+        response = self.client.post('/cart/add/', {'product_id': self.shoe.pk, 'quantity': 2})
+        self.assertEqual(self.lines(response), {self.shoe.pk: 2})
+        response = self.client.post('/cart/add/', {'product_id': self.shoe.pk, 'quantity': 1})
+        self.assertEqual(self.lines(response), {self.shoe.pk: 3})
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn('sessionid', self.client.cookies)
+
+    def test_quantities_below_one_are_rejected(self):
+        for quantity in (0, -3, 'x'):
+            response = self.client.post('/cart/add/', {'product_id': self.shoe.pk, 'quantity': quantity})
+            self.assertRedirects(response, self.shoe.get_absolute_url(), fetch_redirect_response=False)
+            self.assertNotIn(COOKIE_NAME, response.cookies)
+        with self.assertRaises(ValueError):
+            AnonymousCart().add(self.shoe.pk, 0)
+
+    def test_bad_lines_in_the_cookie_are_dropped(self):
+        self.set_cookie({self.shoe.pk: -4, self.boot.pk: 1})
+        response = self.client.get('/cart/')
+        self.assertEqual([item.product for item in response.context['cart_items']], [self.boot])
+        self.assertEqual(self.lines(response), {self.boot.pk: 1})
+
+    def test_login_merges_the_cookie_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.shoe, quantity=1)
+        self.set_cookie({self.shoe.pk: -2, self.boot.pk: 2})
+        response = self.client.post('/accounts/login/', {'username': 'shopper', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(dict(cart.items.values_list('product', 'quantity')), {self.shoe.pk: 1, self.boot.pk: 2})
+        self.assertEqual(response.cookies[COOKIE_NAME].value, '')
+
+
+class AddQuantityTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cart = Cart.objects.create(user=User.objects.create_user('shopper'))
+        cls.product, = make_products((Decimal('10.00'), None))
+
+    def test_upsert_creates_then_increments_the_line(self):
+        before = timezone.now()
+        CartItem.objects.add_quantity(self.cart, self.product.pk, 2)
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+        CartItem.objects.add_quantity(self.cart, self.product.pk, 3)
+        item = CartItem.objects.get()
+        self.assertEqual(item.quantity, 5)
+        # Stored in the backend's datetime format, so lookups on it match
+        self.assertTrue(CartItem.objects.filter(created_at=item.created_at).exists())
+        self.assertGreaterEqual(item.created_at, before)
+
+
+class BatchUpdateTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.shoe, cls.boot = make_products((Decimal('10.00'), None), (Decimal('25.00'), None), stock=5)
+        cls.shoe_item = CartItem.objects.create(cart=cls.cart, product=cls.shoe, quantity=1)
+        cls.boot_item = CartItem.objects.create(cart=cls.cart, product=cls.boot, quantity=1)
+        # Another shopper is checking out with 3 of the 5 shoes
+        other = Cart.objects.create(user=User.objects.create_user('other'))
+        StockReservation.objects.create(
+            cart=other, product=cls.shoe, quantity=3, expires_at=timezone.now() + timedelta(minutes=5),
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def batch(self, *changes):
+        return self.client.post(
+            '/cart/batch/', json.dumps([{'item_id': item_id, 'quantity': quantity} for item_id, quantity in changes]),
+            content_type='application/json',
+        )
+
+    def test_applies_every_change(self):
+        response = self.batch((self.shoe_item.pk, 2), (self.boot_item.pk, 0))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['removed'], [self.boot_item.pk])
+        self.assertEqual(dict(self.cart.items.values_list('product', 'quantity')), {self.shoe.pk: 2})
+
+    def test_stock_held_by_other_carts_is_not_available(self):
+        response = self.batch((self.shoe_item.pk, 3), (self.boot_item.pk, 2))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['errors'], [
+            {'item_id': self.shoe_item.pk, 'error': 'Only 2 of Shoe 0 in stock.'},
+        ])
+        # Nothing was applied
+        self.assertEqual(dict(self.cart.items.values_list('product', 'quantity')), {self.shoe.pk: 1, self.boot.pk: 1})
+
+    def test_own_and_expired_holds_do_not_count(self):
+        StockReservation.objects.filter(product=self.shoe).update(expires_at=timezone.now())
+        StockReservation.objects.create(
+            cart=self.cart, product=self.boot, quantity=1, expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        response = self.batch((self.shoe_item.pk, 5), (self.boot_item.pk, 5))
+        self.assertEqual(response.status_code, 200)
+
+    def test_out_of_range_and_fractional_values_are_rejected_per_line(self):
+        body = (
+            f'[{{"item_id": {self.shoe_item.pk}, "quantity": 1e400}},'
+            f' {{"item_id": 99999999999999999999999, "quantity": 1}},'
+            f' {{"item_id": {self.boot_item.pk}, "quantity": 2.7}},'
+            f' {{"item_id": {self.boot_item.pk}.0, "quantity": true}},'
+            f' {{"item_id": "{self.boot_item.pk}", "quantity": 2}}]'
+        )
+        response = self.client.post('/cart/batch/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            {'line': 0, 'item_id': self.shoe_item.pk, 'error': 'Quantity must be a whole number.'},
+            {'line': 1, 'error': 'Invalid item.'},
+            {'line': 2, 'item_id': self.boot_item.pk, 'error': 'Quantity must be a whole number.'},
+            {'line': 3, 'error': 'Invalid item.'},
+            {'line': 4, 'error': 'Invalid item.'},
+        ])
+        self.assertEqual(dict(self.cart.items.values_list('product', 'quantity')), {self.shoe.pk: 1, self.boot.pk: 1})
+
+    def test_malformed_body_is_rejected(self):
+        for body in ('', 'not json', '{"changes": 3}', '[1, 2]'):
+            with self.subTest(body):
+                response = self.client.post('/cart/batch/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_anonymous_cart_is_checked_against_held_stock(self):
+        self.client.logout()
+        self.client.post('/cart/add/', {'product_id': self.shoe.pk, 'quantity': 1})
+        response = self.batch((self.shoe.pk, 3))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.batch((self.shoe.pk, 2)).status_code, 200)
+
+
+class PurgeAbandonedCartsTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product, = make_products((Decimal('10.00'), None))
+        now = timezone.now()
+        for key in ('live', 'idle', 'idle-with-new-item'):
+            Session.objects.create(session_key=key, session_data='', expire_date=now + timedelta(days=7))
+        cls.live = cls.cart(session_key='live')
+        cls.expired = cls.cart(session_key='gone')
+        cls.idle = cls.cart(session_key='idle', idle_days=40)
+        cls.idle_with_new_item = cls.cart(session_key='idle-with-new-item', idle_days=40)
+        cls.user_cart = cls.cart(user=User.objects.create_user('shopper'), idle_days=400)
+        for cart in (cls.live, cls.expired, cls.idle, cls.idle_with_new_item, cls.user_cart):
+            CartItem.objects.create(cart=cart, product=cls.product, quantity=1)
+        CartItem.objects.filter(cart=cls.idle).update(created_at=now - timedelta(days=40))
+
+    @classmethod
+    def cart(cls, idle_days=0, **fields):
+        cart = Cart.objects.create(**fields)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=idle_days))
+        return cart
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_abandoned_carts', *args, stdout=out)
+        return out.getvalue()
+
+    def test_deletes_expired_and_idle_anonymous_carts_in_chunks(self):
+        output = self.purge('--chunk-size', '1')
+        self.assertIn('Deleted 2 carts and 2 cart items', output)
+        self.assertQuerySetEqual(
+            Cart.objects.order_by('pk'), [self.live, self.idle_with_new_item, self.user_cart],
+        )
+        self.assertEqual(CartItem.objects.count(), 3)
+
+    def test_dry_run_only_counts(self):
+        self.assertIn('Would delete 2 carts and 2 cart items', self.purge('--dry-run'))
+        self.assertEqual(Cart.objects.count(), 5)
+
+
+class ConcurrentAddToCartTests(CatalogTransactionTestCase):
+    """Concurrent adds of the same product must not lose updates"""
+
+    THREADS = 8
+    ADDS_PER_THREAD = 25
+
+    def setUp(self):
+        super().setUp()
+        self.product = make_product('Runner', 'RUN-1', description='Running shoe', stock_quantity=1000)
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def run_concurrently(self, work):
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.ADDS_PER_THREAD):
+                    work()
+            except Exception as exc:  # surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_add_quantity_is_atomic(self):
+        self.run_concurrently(lambda: CartItem.objects.add_quantity(self.cart, self.product.id, 2))
+
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, 2 * self.THREADS * self.ADDS_PER_THREAD)
+
+    def test_add_to_cart_view(self):
+        clients = threading.local()
+
+        def add():
+            if not hasattr(clients, 'client'):
+                client = self.client_class()
+                client.force_login(self.user)
+                clients.client = client
+            response = clients.client.post(
+                '/cart/add/', {'product_id': self.product.id, 'quantity': 1},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+            self.assertEqual(response.status_code, 200)
+
+        self.run_concurrently(add)
+
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, self.THREADS * self.ADDS_PER_THREAD)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 1)
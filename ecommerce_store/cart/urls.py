@@ -7,5 +7,6 @@ urlpatterns = [
     path('', views.cart_detail, name='cart_detail'),
     path('add/', views.add_to_cart, name='add_to_cart'),
     path('update/', views.update_cart, name='update_cart'),
+    path('batch/', views.batch_update_cart, name='batch_update_cart'),
     path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
 ]
\ No newline at end of file
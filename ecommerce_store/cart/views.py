@@ -1,22 +1,35 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
+from django.db import transaction
+from django.db.models import F
 from django.views.decorators.http import require_POST
+from .anonymous import AnonymousCart, anonymous_cart
+from .badge import remember
 from .models import Cart, CartItem
+from orders.reservations import held_quantity, release
 from products.models import Product
 
 def get_or_create_cart(request):
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        if not request.session.session_key:
-            request.session.create()
-        cart, created = Cart.objects.get_or_create(session_key=request.session.session_key)
+    # Anonymous visitors get a cookie-backed cart with no database rows
+    if not request.user.is_authenticated:
+        return anonymous_cart(request)
+    cart, created = Cart.objects.get_or_create(user=request.user)
     return cart
 
+def release_if_empty(cart, summary):
+    # An emptied cart gives back the stock held for its checkout
+    if not summary['items']:
+        release(cart)
+
 def cart_detail(request):
     cart = get_or_create_cart(request)
-    cart_items = cart.items.all()
+    if isinstance(cart, AnonymousCart):
+        cart_items = cart.items()
+    else:
+        cart_items = cart.items.select_related('product__category')
     
     context = {
         'cart': cart,
@@ -27,28 +40,38 @@ def cart_detail(request):
 @require_POST
 def add_to_cart(request):
     product_id = request.POST.get('product_id')
-    quantity = int(request.POST.get('quantity', 1))
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except ValueError:
+        quantity = 0
     
     product = get_object_or_404(Product, id=product_id, is_active=True)
+    if quantity < 1:
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return JsonResponse({'success': False, 'error': 'Invalid quantity.'}, status=400)
+        messages.error(request, 'Please choose a quantity of at least 1.')
+        return redirect(product.get_absolute_url())
     cart = get_or_create_cart(request)
     
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': quantity}
-    )
-    
-    if not created:
-        cart_item.quantity += quantity
-        cart_item.save()
+    if isinstance(cart, AnonymousCart):
+        if not cart.add(product.id, quantity):
+            messages.error(request, 'Your cart is full.')
+            return redirect('cart:cart_detail')
+        summary = cart.summary()
+    else:
+        # Upsert the line and read the totals back in the same transaction
+        with transaction.atomic():
+            CartItem.objects.add_quantity(cart, product.id, quantity)
+            summary = cart.summary()
     
+    remember(request, summary)
     messages.success(request, f'{product.name} added to cart!')
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
-            'cart_items': cart.total_items,
-            'cart_total': float(cart.total_price)
+            'cart_items': summary['items'],
+            'cart_total': float(summary['total'])
         })
     
     return redirect('cart:cart_detail')
@@ -59,23 +82,160 @@ def update_cart(request):
     quantity = int(request.POST.get('quantity', 1))
     
     cart = get_or_create_cart(request)
-    cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+    if isinstance(cart, AnonymousCart):
+        # The anonymous cart's item ids are product ids
+        if not cart.set(int(item_id), quantity):
+            raise Http404
+        messages.success(request, 'Cart updated successfully!' if quantity > 0 else 'Item removed from cart!')
+        remember(request, cart.summary())
+        return redirect('cart:cart_detail')
     
+    # Single-statement update/delete, scoped to this cart
+    lines = CartItem.objects.filter(id=item_id, cart=cart)
     if quantity > 0:
-        cart_item.quantity = quantity
-        cart_item.save()
+        if not lines.update(quantity=quantity):
+            raise Http404
         messages.success(request, 'Cart updated successfully!')
     else:
-        cart_item.delete()
+        if not lines.delete()[0]:
+            raise Http404
         messages.success(request, 'Item removed from cart!')
     
+    summary = cart.summary()
+    release_if_empty(cart, summary)
+    remember(request, summary)
     return redirect('cart:cart_detail')
 
 def remove_from_cart(request, item_id):
     cart = get_or_create_cart(request)
+    if isinstance(cart, AnonymousCart):
+        product = get_object_or_404(Product, id=item_id)
+        if not cart.remove(product.id):
+            raise Http404
+        remember(request, cart.summary())
+        messages.success(request, f'{product.name} removed from cart!')
+        return redirect('cart:cart_detail')
+    
     cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
     product_name = cart_item.product.name
     cart_item.delete()
+    summary = cart.summary()
+    release_if_empty(cart, summary)
+    remember(request, summary)
     
     messages.success(request, f'{product_name} removed from cart!')
-    return redirect('cart:cart_detail')
\ No newline at end of file
+    return redirect('cart:cart_detail')
+
+MAX_BATCH_CHANGES = 100
+# The largest values the id and quantity columns hold
+MAX_ITEM_ID = 2 ** 63 - 1
+MAX_QUANTITY = 2 ** 31 - 1
+
+class InvalidChanges(ValueError):
+
+    def __init__(self, errors):
+        super().__init__('Invalid changes.')
+        self.errors = errors
+
+def whole_number(value, low, high):
+    # JSON numbers only: no floats (2.7, 1e400), no booleans, no strings
+    return type(value) is int and low <= value <= high
+
+def parse_changes(body):
+    """
+    {item id: quantity} from a JSON list (or {"changes": [...]}) of
+    {item_id, quantity}. Raises ValueError for a malformed body and
+    InvalidChanges, with an error per bad line, for out-of-range values.
+    """
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get('changes')
+    if not isinstance(payload, list) or len(payload) > MAX_BATCH_CHANGES:
+        raise ValueError('Invalid changes.')
+    changes, errors = {}, []
+    for line, change in enumerate(payload):
+        if not isinstance(change, dict) or not whole_number(change.get('item_id'), 1, MAX_ITEM_ID):
+            errors.append({'line': line, 'error': 'Invalid item.'})
+        elif not whole_number(change.get('quantity'), 0, MAX_QUANTITY):
+            errors.append({'line': line, 'item_id': change['item_id'], 'error': 'Quantity must be a whole number.'})
+        else:
+            changes[change['item_id']] = change['quantity']
+    if errors:
+        raise InvalidChanges(errors)
+    return changes
+
+def stock_errors(changes, lines):
+    """
+    Validate changes against {item id: (product name, available quantity)}
+    for the cart's lines, available meaning stock minus other carts' holds
+    """
+    errors = []
+    for item_id, quantity in changes.items():
+        if item_id not in lines:
+            errors.append({'item_id': item_id, 'error': 'Item is not in your cart.'})
+        elif quantity > lines[item_id][1]:
+            name, stock = lines[item_id]
+            errors.append({'item_id': item_id, 'error': f'Only {stock} of {name} in stock.'})
+    return errors
+
+@require_POST
+def batch_update_cart(request):
+    """Apply many quantity changes in one request; quantity 0 removes the line"""
+    try:
+        changes = parse_changes(request.body)
+    except InvalidChanges as e:
+        return JsonResponse({'success': False, 'errors': e.errors}, status=400)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid changes.'}, status=400)
+    
+    cart = get_or_create_cart(request)
+    if isinstance(cart, AnonymousCart):
+        # The anonymous cart's item ids are product ids
+        products = (
+            Product.objects.filter(id__in=[item_id for item_id in changes if item_id in cart.lines])
+            .annotate(available=F('stock_quantity') - held_quantity())
+        )
+        lines = {product_id: (name, max(available, 0)) for product_id, name, available in products.values_list('id', 'name', 'available')}
+        errors = stock_errors(changes, lines)
+        if errors:
+            return JsonResponse({'success': False, 'errors': errors}, status=409)
+        for product_id, quantity in changes.items():
+            cart.set(product_id, quantity)
+        summary = cart.summary()
+    else:
+        with transaction.atomic():
+            # One query validates every line's stock, less what other carts
+            # hold for checkout, and locks the lines
+            items = {
+                item.id: item
+                for item in CartItem.objects.select_for_update(of=('self',))
+                .filter(cart=cart, id__in=changes)
+                .select_related('product')
+                .only('id', 'quantity', 'product__name', 'product__stock_quantity')
+                .annotate(available=F('product__stock_quantity') - held_quantity(exclude_cart=cart, product='product'))
+            }
+            errors = stock_errors(changes, {
+                item_id: (item.product.name, max(item.available, 0)) for item_id, item in items.items()
+            })
+            if errors:
+                return JsonResponse({'success': False, 'errors': errors}, status=409)
+            
+            updated = []
+            for item_id, quantity in changes.items():
+                if quantity:
+                    items[item_id].quantity = quantity
+                    updated.append(items[item_id])
+            CartItem.objects.bulk_update(updated, ['quantity'])
+            removed = [item_id for item_id, quantity in changes.items() if not quantity]
+            if removed:
+                CartItem.objects.filter(cart=cart, id__in=removed).delete()
+            summary = cart.summary()
+            release_if_empty(cart, summary)
+    
+    remember(request, summary)
+    return JsonResponse({
+        'success': True,
+        'removed': [item_id for item_id, quantity in changes.items() if not quantity],
+        'cart_items': summary['items'],
+        'cart_total': float(summary['total']),
+    })
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'cart',
     'orders',
     'accounts',
+    'taskqueue',
 ]
 
 MIDDLEWARE = [
@@ -51,6 +52,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'cart.anonymous.AnonymousCartMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -83,10 +85,43 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file-backed test database: in-memory SQLite fails concurrent
+        # writers with "table is locked" instead of waiting for the lock
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The catalog cache is file based so every local worker process sees the same
+# catalog version; point it at a shared backend when running on several hosts.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'catalog',
+    },
+}
+
+
+# Checkout
+# Seconds that stock stays held for a cart once checkout begins
+
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Order numbers: every process that places orders leases its own node
+# (0-1023) from the database for ORDER_NUMBER_NODE_LEASE seconds. Pin a
+# process to a node with ORDER_NUMBER_NODE; it then fails to number orders
+# while another process holds that node.
+ORDER_NUMBER_NODE_LEASE = 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_store.settings')
 
 application = get_wsgi_application()
+
+# Build the in-process search indexes in the background before traffic arrives
+from products import bm25, suggest  # noqa: E402
+
+suggest.index.refresh()
+bm25.index.refresh()
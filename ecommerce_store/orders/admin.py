@@ -1,5 +1,6 @@
-from django.contrib import admin
-from .models import Order, OrderItem
+from django.contrib import admin, messages
+from .models import Order, OrderItem, OrderStatusEvent, StockReservation
+from .status import sources, transition
 
 # Inline for OrderItem in Order admin
 class OrderItemInline(admin.TabularInline):
@@ -8,6 +9,17 @@ class OrderItemInline(admin.TabularInline):
     readonly_fields = ['total']
     fields = ['product', 'quantity', 'price', 'total']
 
+# Read-only status history for Order admin
+class OrderStatusEventInline(admin.TabularInline):
+    model = OrderStatusEvent
+    extra = 0
+    can_delete = False
+    fields = ['from_status', 'to_status', 'changed_by', 'created_at']
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = [
@@ -22,9 +34,10 @@ class OrderAdmin(admin.ModelAdmin):
         'order_number', 'user__username', 'user__email', 
         'first_name', 'last_name', 'email', 'phone'
     ]
-    list_editable = ['status', 'payment_status']
-    readonly_fields = ['order_number', 'created_at', 'updated_at']
-    inlines = [OrderItemInline]
+    # Status only changes through the transition actions below
+    list_editable = ['payment_status']
+    readonly_fields = ['order_number', 'status', 'created_at', 'updated_at']
+    inlines = [OrderItemInline, OrderStatusEventInline]
     
     fieldsets = (
         ('Order Information', {
@@ -62,23 +75,67 @@ class OrderAdmin(admin.ModelAdmin):
     )
     
     # Custom actions
-    actions = ['mark_as_processing', 'mark_as_shipped', 'mark_as_delivered']
+    actions = ['mark_as_processing', 'mark_as_shipped', 'mark_as_delivered', 'mark_as_cancelled']
+    
+    def transition_selected(self, request, queryset, to_status):
+        # Count first: the queryset may be filtered on the status being changed
+        selected = queryset.count()
+        changed = transition(queryset, to_status, user=request.user)
+        moved = sum(len(ids) for ids in changed.values())
+        label = dict(Order.STATUS_CHOICES)[to_status]
+        self.message_user(request, f"{moved} order{'s' if moved != 1 else ''} marked as {label}.")
+        skipped = selected - moved
+        if skipped > 0:
+            allowed = ', '.join(sources(to_status))
+            self.message_user(
+                request,
+                f"{skipped} order{'s' if skipped != 1 else ''} skipped: only {allowed} orders can become {label}.",
+                messages.WARNING,
+            )
     
     def mark_as_processing(self, request, queryset):
-        queryset.update(status='processing')
+        self.transition_selected(request, queryset, 'processing')
     mark_as_processing.short_description = "Mark selected orders as Processing"
     
     def mark_as_shipped(self, request, queryset):
-        queryset.update(status='shipped')
+        self.transition_selected(request, queryset, 'shipped')
     mark_as_shipped.short_description = "Mark selected orders as Shipped"
     
     def mark_as_delivered(self, request, queryset):
-        queryset.update(status='delivered')
+        self.transition_selected(request, queryset, 'delivered')
     mark_as_delivered.short_description = "Mark selected orders as Delivered"
+    
+    def mark_as_cancelled(self, request, queryset):
+        self.transition_selected(request, queryset, 'cancelled')
+    mark_as_cancelled.short_description = "Cancel selected orders"
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product', 'quantity', 'price', 'total']
     list_filter = ['order__status', 'order__created_at']
     search_fields = ['order__order_number', 'product__name']
-    readonly_fields = ['total']
\ No newline at end of file
+    readonly_fields = ['total']
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'cart', 'quantity', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    search_fields = ['product__name', 'product__sku']
+    raw_id_fields = ['cart', 'product']
+
+@admin.register(OrderStatusEvent)
+class OrderStatusEventAdmin(admin.ModelAdmin):
+    list_display = ['order', 'from_status', 'to_status', 'changed_by', 'created_at']
+    list_filter = ['to_status', 'created_at']
+    search_fields = ['order__order_number']
+    list_select_related = ['order', 'changed_by']
+
+    # Append-only: the log can be read but never edited
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
\ No newline at end of file
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders import reservations
+
+
+class Command(BaseCommand):
+    help = 'Delete expired checkout stock reservations (run every minute or so)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Reservations deleted per transaction')
+        parser.add_argument('--loop', type=float, default=None, help='Keep sweeping every N seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            deleted = reservations.release_expired(options['chunk_size'])
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f'Released {deleted} expired reservations in {elapsed:.1f}s'))
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
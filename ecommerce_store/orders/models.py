@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from cart.models import Cart
 from products.models import Product
+from .numbering import generate_order_number
 from decimal import Decimal
 
 class Order(models.Model):
@@ -39,19 +42,24 @@ class Order(models.Model):
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=50, blank=True)
     notes = models.TextField(blank=True)
+    # Issued with the checkout form; a replayed submission finds this order
+    checkout_token = models.CharField(max_length=32, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Order history: a user's orders, newest first
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.order_number}"
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            import uuid
-            self.order_number = str(uuid.uuid4())[:8].upper()
+            self.order_number = generate_order_number()
         super().save(*args, **kwargs)
 
 class OrderItem(models.Model):
@@ -66,4 +74,60 @@ class OrderItem(models.Model):
 
     def save(self, *args, **kwargs):
         self.total = self.price * self.quantity
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class StockReservationQuerySet(models.QuerySet):
+
+    def active(self, now=None):
+        return self.filter(expires_at__gt=now or timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+class StockReservation(models.Model):
+    """Stock held for a cart between starting checkout and placing the order"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('cart', 'product')
+        indexes = [
+            models.Index(fields=['product', 'expires_at'], name='reservation_product_exp_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} x {self.quantity} for {self.cart}"
+
+class OrderStatusEvent(models.Model):
+    """Append-only log of order status changes (see orders/status.py)"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_events')
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_status} -> {self.to_status}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Order status events are append-only')
+        super().save(*args, **kwargs)
+
+class OrderNumberNode(models.Model):
+    """A Snowflake node number leased by one order-placing process (see orders/numbering.py)"""
+    node = models.PositiveSmallIntegerField(primary_key=True)
+    holder = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Node {self.node} held by {self.holder}"
@@ -0,0 +1,170 @@
+"""
+Order number generation.
+
+The default generator builds Snowflake-style 64-bit IDs: milliseconds since
+EPOCH_MS, a 10-bit node number and a 12-bit per-millisecond sequence,
+written as 13 Crockford base32 characters. Numbers from one node never
+repeat and sort by creation time, so new orders append to the end of the
+order_number index instead of landing at random positions in it.
+
+Two processes must never share a node, so nodes are leased through the
+OrderNumberNode table: each process claims a node that is free or whose
+lease has expired (or the one set in ORDER_NUMBER_NODE, failing with
+ImproperlyConfigured if another process holds it) and renews the lease once
+half of ORDER_NUMBER_NODE_LEASE has passed. A claim only counts once the
+transaction it was made in has committed; until then every number claims
+again. A process that finds its lease taken over claims another node.
+Another generator can be plugged in with ORDER_NUMBER_GENERATOR, the dotted
+path of a callable class taking no arguments.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # Crockford base32
+LENGTH = 13  # 64 bits / 5 bits per character, rounded up
+DEFAULT_LEASE = 60 * 60
+
+
+def encode(number):
+    chars = []
+    for _ in range(LENGTH):
+        number, remainder = divmod(number, 32)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+
+def lease_duration():
+    return timedelta(seconds=getattr(settings, 'ORDER_NUMBER_NODE_LEASE', DEFAULT_LEASE))
+
+
+def configured_node():
+    configured = getattr(settings, 'ORDER_NUMBER_NODE', None)
+    if configured is not None and not 0 <= configured <= MAX_NODE:
+        raise ImproperlyConfigured(f'ORDER_NUMBER_NODE must be between 0 and {MAX_NODE}')
+    return configured
+
+
+def take_node(node, holder, expires_at):
+    """Lease node to holder if it is unused, expired or already theirs"""
+    from .models import OrderNumberNode
+
+    now = timezone.now()
+    if OrderNumberNode.objects.filter(Q(holder=holder) | Q(expires_at__lte=now), node=node).update(
+        holder=holder, expires_at=expires_at,
+    ):
+        return True
+    try:
+        with transaction.atomic():
+            OrderNumberNode.objects.create(node=node, holder=holder, expires_at=expires_at)
+    except IntegrityError:
+        # Leased to another process, or claimed by one just now
+        return False
+    return True
+
+
+def claim_node(holder, node=None, previous=None):
+    """
+    Lease a node to holder and return it with the lease's expiry: `node` if
+    given, else `previous` while it is still ours, else any node that is
+    expired or unused. Raises ImproperlyConfigured if none can be had.
+    """
+    from .models import OrderNumberNode
+
+    expires_at = timezone.now() + lease_duration()
+    if node is not None:
+        if not take_node(node, holder, expires_at):
+            held_by = OrderNumberNode.objects.filter(node=node).values_list('holder', flat=True).first()
+            raise ImproperlyConfigured(f'Order number node {node} is already leased to {held_by}')
+        return node, expires_at
+
+    leases = dict(OrderNumberNode.objects.values_list('node', 'expires_at'))
+    now = timezone.now()
+    candidates = [previous] if previous is not None else []
+    candidates += sorted(n for n, lease_expires in leases.items() if lease_expires <= now)
+    candidates += [n for n in range(MAX_NODE + 1) if n not in leases]
+    for candidate in candidates:
+        if take_node(candidate, holder, expires_at):
+            return candidate, expires_at
+    raise ImproperlyConfigured(f'All {MAX_NODE + 1} order number nodes are leased')
+
+
+class SnowflakeGenerator:
+
+    def __init__(self, node=None):
+        self.node = node
+        self.lock = threading.Lock()
+        self.pid = None
+        self.last_ms = -1
+        self.sequence = 0
+
+    def lease(self):
+        """Make sure this process holds its node, claiming or renewing it"""
+        if self.node_id is not None and self.renew_at is not None and timezone.now() < self.renew_at:
+            return
+        node = configured_node() if self.node is None else self.node
+        self.node_id, expires_at = claim_node(self.holder, node, previous=self.node_id)
+        self.renew_at = None
+        claimed = self.node_id
+
+        def confirm():
+            # The lease row is committed; trust it until half of it has passed
+            if self.node_id == claimed:
+                self.renew_at = expires_at - lease_duration() / 2
+
+        transaction.on_commit(confirm)
+
+    def __call__(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # First use, or a forked worker: this process needs its own node
+                self.pid = os.getpid()
+                self.holder = f'{socket.gethostname()}:{self.pid}:{uuid.uuid4().hex[:8]}'
+                self.node_id = self.renew_at = None
+                self.last_ms, self.sequence = -1, 0
+            self.lease()
+
+            now = int(time.time() * 1000) - EPOCH_MS
+            # Never step backwards, even if the wall clock does
+            now = max(now, self.last_ms)
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # 4096 numbers used this millisecond: borrow the next one
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last_ms = now
+
+            number = (now << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self.sequence
+            return encode(number)
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def generate_order_number():
+    global _generator
+    if _generator is None:
+        # Two generators sharing a node could hand out the same number
+        with _generator_lock:
+            if _generator is None:
+                path = getattr(settings, 'ORDER_NUMBER_GENERATOR', 'orders.numbering.SnowflakeGenerator')
+                _generator = import_string(path)()
+    return _generator()
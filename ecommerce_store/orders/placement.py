@@ -0,0 +1,108 @@
+"""
+Set-based order placement.
+
+Stock for every line is taken in a single conditional UPDATE: each product's
+row is only decremented if it still has enough stock, so two checkouts can
+never oversell, and no full-row save can overwrite a concurrent edit. If the
+statement touched fewer rows than there are lines, something ran out: the
+partial update is rolled back to a savepoint and OutOfStock names the
+product, so the caller's transaction can be rolled back as a whole.
+
+Cancelling an order returns its items to stock (return_stock, called by
+status.transition in the cancelling transaction). Taking or returning stock
+touches only the products' updated_at, which the
+product page's conditional GET validators are built from. Cached catalog
+listings show stock_status, which an order doesn't change, so the catalog
+version is left alone and placing an order doesn't empty the catalog cache.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Now
+
+from products.models import Product
+
+from .models import Order, OrderItem
+from .reservations import held_quantity, release
+
+
+class _ShortStock(Exception):
+    pass
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, product):
+        super().__init__(f'Insufficient stock for {product.name}')
+        self.product = product
+
+
+def take_stock(cart_items, cart=None):
+    """
+    Decrement stock for every cart line in one statement, or raise
+    OutOfStock. Stock held by other carts' reservations is not available.
+    """
+    quantities, products = {}, {}
+    for item in cart_items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        products[item.product_id] = item.product
+    requested = Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(
+                id__in=quantities,
+                stock_quantity__gte=requested + held_quantity(exclude_cart=cart),
+            ).update(
+                stock_quantity=F('stock_quantity') - requested,
+                updated_at=Now(),
+            )
+            if updated != len(quantities):
+                raise _ShortStock
+    except _ShortStock:
+        # Only reached on failure, with the partial update rolled back: find
+        # a line that couldn't be covered
+        stock = dict(
+            Product.objects.filter(id__in=quantities)
+            .annotate(available=F('stock_quantity') - held_quantity(exclude_cart=cart))
+            .values_list('id', 'available')
+        )
+        short = [product_id for product_id, quantity in quantities.items() if stock.get(product_id, 0) < quantity]
+        raise OutOfStock(products[short[0] if short else next(iter(products))])
+
+
+def return_stock(order_ids):
+    """Put the items of the given (cancelled) orders back in stock with one UPDATE"""
+    items = OrderItem.objects.filter(order_id__in=order_ids)
+    returned = items.filter(product=OuterRef('pk')).values('product').annotate(total=Sum('quantity')).values('total')
+    Product.objects.filter(id__in=items.values('product')).update(
+        stock_quantity=F('stock_quantity') + Subquery(returned),
+        updated_at=Now(),
+    )
+
+
+def place_order(cart, cart_items, **order_fields):
+    """
+    Create an Order with one OrderItem per cart line, take the stock for it
+    and drop the cart's reservations. Must run inside a transaction; raises
+    OutOfStock.
+    """
+    cart_items = list(cart_items)
+    # The order row goes first: a concurrent submission with the same
+    # checkout_token fails on its unique constraint before touching stock
+    order = Order.objects.create(**order_fields)
+    take_stock(cart_items, cart)
+    release(cart)
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=item.product,
+            quantity=item.quantity,
+            price=item.product.effective_price,
+            # bulk_create skips OrderItem.save(), which normally fills this in
+            total=item.product.effective_price * item.quantity,
+        )
+        for item in cart_items
+    ])
+    return order
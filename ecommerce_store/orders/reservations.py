@@ -0,0 +1,141 @@
+"""
+Inventory holds taken when checkout begins.
+
+Opening the checkout page reserves every cart line for
+settings.STOCK_RESERVATION_TTL seconds, provided the stock minus the active
+holds of other carts covers it. Reloading the page keeps the holds that
+still match their lines without locking any product; see reserve().
+Placing the order takes the stock (see placement.take_stock, which honours
+other carts' holds) and releases the cart's holds, as does emptying the
+cart. Expired holds stop counting immediately; the
+release_expired_reservations command deletes them.
+
+Holds change the quantity shown on product pages, so taking or releasing
+them touches the products' updated_at, which the conditional GET
+validators are built from.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Now
+from django.utils import timezone
+
+from products.models import Product
+
+from .models import StockReservation
+
+DEFAULT_TTL = 15 * 60
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_TTL))
+
+
+def held_quantity(exclude_cart=None, product='pk'):
+    """Subquery: the quantity of OuterRef(product) held by active reservations"""
+    holds = StockReservation.objects.active().filter(product=OuterRef(product))
+    if exclude_cart is not None:
+        holds = holds.exclude(cart=exclude_cart)
+    return Coalesce(Subquery(holds.values('product').annotate(total=Sum('quantity')).values('total')), Value(0))
+
+
+def with_available(queryset):
+    """Annotate products with `available_quantity`: stock minus active holds"""
+    return queryset.annotate(available_quantity=Greatest(F('stock_quantity') - held_quantity(), Value(0)))
+
+
+def touch(product_ids):
+    Product.objects.filter(id__in=product_ids).update(updated_at=Now())
+
+
+def reserve(cart, cart_items):
+    """
+    Hold stock for every cart line, replacing the cart's previous holds.
+    Returns [(product, available quantity)] for the lines that can't be
+    held; in that case nothing is held.
+
+    Only lines whose hold is new, changed or expired lock their product rows
+    and check stock. Holds that still match their line are kept, and once
+    half their TTL has passed they are extended without any product lock.
+    """
+    quantities, products = {}, {}
+    for item in cart_items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        products[item.product_id] = item.product
+
+    now = timezone.now()
+    expires_at = now + reservation_ttl()
+    with transaction.atomic():
+        current = {
+            product_id: (quantity, held_until)
+            for product_id, quantity, held_until in StockReservation.objects.filter(cart=cart)
+            .values_list('product_id', 'quantity', 'expires_at')
+        }
+        kept = {
+            product_id for product_id, (quantity, held_until) in current.items()
+            if quantities.get(product_id) == quantity and held_until > now
+        }
+        renew_after = now + reservation_ttl() / 2
+        if any(current[product_id][1] <= renew_after for product_id in kept):
+            extended = StockReservation.objects.filter(
+                cart=cart, product_id__in=kept, expires_at__gt=now,
+            ).update(expires_at=expires_at)
+            if extended != len(kept):
+                # Some expired (or were released) meanwhile: take them again
+                kept = set()
+
+        changed = set(quantities) - kept
+        shortages = []
+        if changed:
+            # Lock the product rows (in id order) so concurrent reservations
+            # for the same products queue up instead of both seeing the same stock
+            available = dict(
+                Product.objects.filter(id__in=changed).select_for_update().order_by('id')
+                .annotate(available=F('stock_quantity') - held_quantity(exclude_cart=cart))
+                .values_list('id', 'available')
+            )
+            shortages = [
+                (products[product_id], max(available.get(product_id, 0), 0))
+                for product_id in changed
+                if available.get(product_id, 0) < quantities[product_id]
+            ]
+        if shortages:
+            StockReservation.objects.filter(cart=cart).delete()
+            touch(set(current))
+            return shortages
+
+        replaced = (set(current) - set(quantities)) | changed
+        if replaced:
+            StockReservation.objects.filter(cart=cart, product_id__in=replaced).delete()
+            StockReservation.objects.bulk_create([
+                StockReservation(cart=cart, product_id=product_id, quantity=quantities[product_id],
+                                 expires_at=expires_at)
+                for product_id in changed
+            ])
+            touch(replaced)
+    return shortages
+
+
+def release(cart):
+    """Drop the cart's holds (after its order is placed, or it is abandoned)"""
+    product_ids = list(StockReservation.objects.filter(cart=cart).values_list('product_id', flat=True))
+    if product_ids:
+        StockReservation.objects.filter(cart=cart).delete()
+        touch(product_ids)
+
+
+def release_expired(chunk_size=1000):
+    """Delete expired holds in primary-key chunks. Returns the number deleted."""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        chunk = list(
+            StockReservation.objects.expired(now).order_by('pk').values_list('pk', 'product_id')[:chunk_size]
+        )
+        if not chunk:
+            return deleted
+        with transaction.atomic():
+            deleted += StockReservation.objects.filter(pk__in=[pk for pk, _ in chunk]).delete()[0]
+            touch({product_id for _, product_id in chunk})
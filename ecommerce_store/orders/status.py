@@ -0,0 +1,100 @@
+"""
+Order status state machine.
+
+TRANSITIONS lists the statuses each status may move to. transition() moves a
+whole queryset at once: for every status allowed to reach the target it runs
+one conditional UPDATE (WHERE status = <source>), so orders in any other
+status are left alone, then bulk-inserts an OrderStatusEvent per changed
+order. Cancelled orders (which can't have shipped) have their items put back
+in stock in the same transaction, so a status change and its stock can't
+disagree. order_status_changed is sent once the transaction commits.
+"""
+from django.db import connection, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Order, OrderStatusEvent
+from .placement import return_stock
+
+TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+
+# Sent with to_status and changed={from_status: [order ids]}
+order_status_changed = Signal()
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+def sources(to_status):
+    return [from_status for from_status, targets in TRANSITIONS.items() if to_status in targets]
+
+
+def _update(queryset, from_status, to_status, now):
+    """Move the queryset's orders in from_status to to_status; returns their ids"""
+    if connection.vendor in ('sqlite', 'postgresql'):
+        subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+        table = connection.ops.quote_name(Order._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET status = %s, updated_at = %s '
+                f'WHERE status = %s AND id IN ({subquery}) RETURNING id',
+                [to_status, connection.ops.adapt_datetimefield_value(now), from_status, *params],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    # No UPDATE ... RETURNING: lock the rows, then update exactly those
+    ids = list(queryset.filter(status=from_status).select_for_update().values_list('pk', flat=True))
+    Order.objects.filter(pk__in=ids, status=from_status).update(status=to_status, updated_at=now)
+    return ids
+
+
+def transition(queryset, to_status, user=None):
+    """
+    Move every order in queryset that may reach to_status there. Returns
+    {from_status: [order ids]} for the orders that changed.
+    """
+    if to_status not in TRANSITIONS:
+        raise InvalidTransition(f'Unknown order status {to_status!r}')
+    now = timezone.now()
+    changed = {}
+    with transaction.atomic():
+        for from_status in sources(to_status):
+            ids = _update(queryset, from_status, to_status, now)
+            if not ids:
+                continue
+            changed[from_status] = ids
+            OrderStatusEvent.objects.bulk_create(
+                [
+                    OrderStatusEvent(order_id=order_id, from_status=from_status, to_status=to_status,
+                                     changed_by=user, created_at=now)
+                    for order_id in ids
+                ],
+                batch_size=1000,
+            )
+        if to_status == 'cancelled' and changed:
+            return_stock([order_id for ids in changed.values() for order_id in ids])
+        if changed:
+            transaction.on_commit(
+                lambda: order_status_changed.send(sender=Order, to_status=to_status, changed=changed)
+            )
+    return changed
+
+
+def transition_order(order, to_status, user=None):
+    """Move a single order, raising InvalidTransition if it isn't allowed"""
+    if not can_transition(order.status, to_status):
+        raise InvalidTransition(f'Order {order.order_number} cannot go from {order.status} to {to_status}')
+    if not transition(Order.objects.filter(pk=order.pk), to_status, user):
+        raise InvalidTransition(f'Order {order.order_number} changed status concurrently')
+    order.status = to_status
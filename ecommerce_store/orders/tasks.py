@@ -0,0 +1,65 @@
+"""
+Work that follows a placed order, run by `manage.py run_worker`.
+
+Checkout queues a single order_placed task; it fans out into the
+individual follow-ups so each one is retried on its own. Payment webhooks,
+analytics and other post-order hooks belong here as further tasks.
+"""
+import logging
+
+from django.conf import settings
+from django.core.mail import mail_admins, send_mail
+
+from taskqueue.queue import enqueue_many, task
+
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOW_STOCK_THRESHOLD = 5
+
+
+@task()
+def order_placed(order_id):
+    enqueue_many([
+        (send_order_confirmation, {'order_id': order_id}),
+        (check_stock_levels, {'order_id': order_id}),
+    ])
+
+
+@task()
+def send_order_confirmation(order_id):
+    order = Order.objects.get(id=order_id)
+    lines = [
+        f"{item.product.name} x {item.quantity}: Rs {item.total}"
+        for item in order.items.select_related('product')
+    ]
+    send_mail(
+        f'Order #{order.order_number} confirmed',
+        '\n'.join([
+            f'Hi {order.first_name},',
+            '',
+            f'Thank you for your order #{order.order_number}.',
+            '',
+            *lines,
+            '',
+            f'Total: Rs {order.total_amount}',
+        ]),
+        None,
+        [order.email],
+    )
+
+
+@task()
+def check_stock_levels(order_id):
+    """Tell the admins about products this order left at or below the threshold"""
+    threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', DEFAULT_LOW_STOCK_THRESHOLD)
+    low = list(
+        OrderItem.objects.filter(order_id=order_id, product__stock_quantity__lte=threshold)
+        .values_list('product__name', 'product__sku', 'product__stock_quantity')
+    )
+    if not low:
+        return
+    body = '\n'.join(f'{name} ({sku}): {stock} left' for name, sku, stock in low)
+    logger.warning(f"Low stock after order {order_id}:\n{body}")
+    mail_admins(f'Low stock: {len(low)} product{"s" if len(low) != 1 else ""}', body)
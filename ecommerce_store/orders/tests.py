@@ -1,3 +1,341 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from products.cache import catalog_version
+from products.models import Product
+from products.testing import CatalogTestCase, make_product
+
+from .models import Order, OrderItem, OrderNumberNode, OrderStatusEvent, StockReservation
+from .numbering import SnowflakeGenerator
+from .reservations import reserve
+from .status import TRANSITIONS, InvalidTransition, order_status_changed, transition, transition_order
+
+ADDRESS = {
+    'first_name': 'Ram', 'last_name': 'Shrestha', 'email': 'ram@example.com', 'phone': '9800000000',
+    'address_line_1': 'Durbar Marg 1', 'city': 'Kathmandu', 'state': 'Bagmati', 'postal_code': '44600',
+    'country': 'Nepal',
+}
+
+
+def make_order(user, *lines, **fields):
+    order = Order.objects.create(
+        user=user, subtotal=Decimal('0.00'), total_amount=Decimal('0.00'), **dict(ADDRESS, **fields),
+    )
+    for product, quantity in lines:
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+    return order
+
+
+class CheckoutTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.shoe = make_product('Shoe', 'SHOE-1', stock_quantity=5)
+        cls.boot = make_product('Boot', 'BOOT-1', stock_quantity=5)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def fill_cart(self, *lines):
+        for product, quantity in lines:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+
+    def place(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/orders/checkout/', dict(ADDRESS, **fields))
+
+    def test_order_takes_stock_without_bumping_the_catalog_version(self):
+        self.fill_cart((self.shoe, 2), (self.boot, 1))
+        before = Product.objects.get(pk=self.shoe.pk).updated_at
+        version = catalog_version()
+
+        response = self.place()
+
+        order = Order.objects.get()
+        self.assertRedirects(response, f'/orders/success/{order.order_number}/', fetch_redirect_response=False)
+        self.assertEqual(order.total_amount, Decimal('339.00'))
+        self.assertEqual(dict(order.items.values_list('product', 'quantity')), {self.shoe.pk: 2, self.boot.pk: 1})
+        shoe = Product.objects.get(pk=self.shoe.pk)
+        self.assertEqual(shoe.stock_quantity, 3)
+        self.assertGreater(shoe.updated_at, before)
+        self.assertEqual(catalog_version(), version)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_replayed_submission_goes_to_the_same_order(self):
+        self.fill_cart((self.shoe, 2))
+        token = self.client.get('/orders/checkout/').context['checkout_token']
+
+        first = self.place(checkout_token=token)
+        # The cart is empty by now; a replay must not fall through to it
+        with self.assertNumQueries(3):
+            replay = self.client.post('/orders/checkout/', dict(ADDRESS, checkout_token=token))
+
+        order = Order.objects.get()
+        self.assertEqual(order.checkout_token, token)
+        self.assertEqual(replay['Location'], first['Location'])
+        self.assertEqual(Product.objects.get(pk=self.shoe.pk).stock_quantity, 3)
+
+    def test_short_stock_places_nothing(self):
+        self.fill_cart((self.shoe, 1), (self.boot, 6))
+
+        response = self.place()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Insufficient stock for Boot')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(
+            dict(Product.objects.values_list('pk', 'stock_quantity')), {self.shoe.pk: 5, self.boot.pk: 5},
+        )
+
+
+@override_settings(STOCK_RESERVATION_TTL=600)
+class ReservationTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret')
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.shoe = make_product('Shoe', 'SHOE-1', stock_quantity=5)
+        cls.item = CartItem.objects.create(cart=cls.cart, product=cls.shoe, quantity=2)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def holds(self):
+        return dict(StockReservation.objects.filter(cart=self.cart).values_list('product', 'quantity'))
+
+    def updated_at(self):
+        return Product.objects.get(pk=self.shoe.pk).updated_at
+
+    def test_opening_checkout_holds_the_cart(self):
+        self.assertEqual(self.client.get('/orders/checkout/').status_code, 200)
+        self.assertEqual(self.holds(), {self.shoe.pk: 2})
+
+    def test_reloading_reuses_matching_holds_without_writing(self):
+        self.client.get('/orders/checkout/')
+        hold = StockReservation.objects.get()
+        touched = self.updated_at()
+
+        self.client.get('/orders/checkout/')
+
+        self.assertEqual(StockReservation.objects.get(), hold)
+        self.assertEqual(StockReservation.objects.get().expires_at, hold.expires_at)
+        self.assertEqual(self.updated_at(), touched)
+
+    def test_changed_cart_or_aging_holds_are_renewed(self):
+        self.client.get('/orders/checkout/')
+        CartItem.objects.filter(pk=self.item.pk).update(quantity=3)
+        self.client.get('/orders/checkout/')
+        self.assertEqual(self.holds(), {self.shoe.pk: 3})
+
+        StockReservation.objects.update(expires_at=timezone.now() + timedelta(seconds=200))
+        self.client.get('/orders/checkout/')
+        self.assertGreater(StockReservation.objects.get().expires_at, timezone.now() + timedelta(seconds=500))
+
+    def test_extending_matching_holds_takes_no_product_lock(self):
+        self.client.get('/orders/checkout/')
+        StockReservation.objects.update(expires_at=timezone.now() + timedelta(seconds=200))
+        touched = self.updated_at()
+        items = list(self.cart.items.select_related('product'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(reserve(self.cart, items), [])
+
+        self.assertEqual([query['sql'] for query in queries if 'products_product' in query['sql']], [])
+        self.assertGreater(StockReservation.objects.get().expires_at, timezone.now() + timedelta(seconds=500))
+        self.assertEqual(self.updated_at(), touched)
+
+    def test_only_new_lines_are_checked_and_touched(self):
+        self.client.get('/orders/checkout/')
+        hold = StockReservation.objects.get()
+        touched = self.updated_at()
+        boot = make_product('Boot', 'BOOT-1', stock_quantity=5)
+        CartItem.objects.create(cart=self.cart, product=boot, quantity=1)
+
+        self.client.get('/orders/checkout/')
+
+        self.assertEqual(self.holds(), {self.shoe.pk: 2, boot.pk: 1})
+        self.assertEqual(StockReservation.objects.get(product=self.shoe).pk, hold.pk)
+        self.assertEqual(self.updated_at(), touched)
+        self.assertGreater(Product.objects.get(pk=boot.pk).updated_at, boot.updated_at)
+
+    def test_stock_held_by_another_cart_sends_the_shopper_back(self):
+        other = Cart.objects.create(user=User.objects.create_user('other'))
+        StockReservation.objects.create(
+            cart=other, product=self.shoe, quantity=4, expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        response = self.client.get('/orders/checkout/')
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertEqual(self.holds(), {})
+
+    def test_placing_the_order_releases_the_holds(self):
+        self.client.get('/orders/checkout/')
+        self.client.post('/orders/checkout/', ADDRESS)
+        self.assertTrue(Order.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_emptying_the_cart_releases_the_holds(self):
+        self.client.get('/orders/checkout/')
+        touched = self.updated_at()
+        self.client.get(f'/cart/remove/{self.item.pk}/')
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertGreater(self.updated_at(), touched)
+
+
+class OrderListTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='secret')
+        shoe, boot, sock = make_product('Shoe', 'SHOE-1'), make_product('Boot', 'BOOT-1'), make_product('Sock', 'SOCK-1')
+        lines = [(shoe, 1), (boot, 2), (sock, 3)]
+        cls.orders = [make_order(cls.user, *lines[:i % 3 + 1]) for i in range(12)]
+        make_order(User.objects.create_user('other'), (shoe, 1))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_pages_are_newest_first_with_line_counts(self):
+        first = self.client.get('/orders/').context['orders']
+        self.assertEqual(first.paginator.count, 12)
+        self.assertEqual(list(first), self.orders[::-1][:10])
+        self.assertEqual([order.item_count for order in first], [i % 3 + 1 for i in range(11, 1, -1)])
+        second = self.client.get('/orders/?page=2').context['orders']
+        self.assertEqual(list(second), self.orders[1::-1])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        # The first request also stores the cart badge in the session
+        self.client.get('/orders/')
+        # Session, user, COUNT and the page itself, for 10 orders or 2
+        with self.assertNumQueries(4):
+            self.assertContains(self.client.get('/orders/'), '3 items')
+        with self.assertNumQueries(4):
+            self.client.get('/orders/?page=2')
+
+
+class StatusTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='secret')
+        cls.shoe = make_product('Shoe', 'SHOE-1', stock_quantity=5)
+        cls.boot = make_product('Boot', 'BOOT-1', stock_quantity=5)
+        cls.orders = {
+            status: make_order(cls.admin, (cls.shoe, 1), (cls.boot, 2), status=status) for status in TRANSITIONS
+        }
+
+    def stock(self):
+        return dict(Product.objects.values_list('name', 'stock_quantity'))
+
+    def test_only_orders_allowed_to_reach_the_target_move(self):
+        received = []
+        order_status_changed.connect(lambda **kwargs: received.append(kwargs), weak=False, dispatch_uid='test')
+        self.addCleanup(order_status_changed.disconnect, dispatch_uid='test')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            changed = transition(Order.objects.all(), 'shipped', user=self.admin)
+
+        self.assertEqual(changed, {'processing': [self.orders['processing'].pk]})
+        self.assertEqual(
+            dict(Order.objects.values_list('pk', 'status')),
+            {order.pk: 'shipped' if status == 'processing' else status for status, order in self.orders.items()},
+        )
+        event = OrderStatusEvent.objects.get()
+        self.assertEqual(
+            (event.order, event.from_status, event.to_status, event.changed_by),
+            (self.orders['processing'], 'processing', 'shipped', self.admin),
+        )
+        self.assertEqual(len(received), 1)
+        self.assertEqual((received[0]['to_status'], received[0]['changed']), ('shipped', changed))
+
+    def test_transition_order_rejects_moves_outside_the_table(self):
+        with self.assertRaises(InvalidTransition):
+            transition_order(self.orders['delivered'], 'cancelled')
+        with self.assertRaises(InvalidTransition):
+            transition(Order.objects.all(), 'lost')
+        self.assertFalse(OrderStatusEvent.objects.exists())
+
+    def test_cancelling_returns_the_items_to_stock(self):
+        changed = transition(Order.objects.all(), 'cancelled')
+
+        self.assertEqual(sorted(changed), ['pending', 'processing'])
+        # Two cancelled orders, each with 1 shoe and 2 boots
+        self.assertEqual(self.stock(), {'Shoe': 7, 'Boot': 9})
+        # Already cancelled: nothing moves, nothing is returned again
+        self.assertEqual(transition(Order.objects.all(), 'cancelled'), {})
+        self.assertEqual(self.stock(), {'Shoe': 7, 'Boot': 9})
+
+    def test_admin_action_reports_skipped_orders(self):
+        self.client.force_login(self.admin)
+        response = self.client.post('/admin/orders/order/', {
+            'action': 'mark_as_cancelled',
+            '_selected_action': [order.pk for order in self.orders.values()],
+        }, follow=True)
+        self.assertEqual(
+            [str(message) for message in response.context['messages']],
+            ['2 orders marked as Cancelled.', '3 orders skipped: only pending, processing orders can become Cancelled.'],
+        )
+        self.assertEqual(OrderStatusEvent.objects.filter(changed_by=self.admin).count(), 2)
+        self.assertEqual(self.stock(), {'Shoe': 7, 'Boot': 9})
+
+
+class OrderNumberTests(TestCase):
+
+    def generator(self):
+        generator = SnowflakeGenerator()
+        with self.captureOnCommitCallbacks(execute=True):
+            generator()
+        return generator
+
+    def test_numbers_are_unique_and_sorted(self):
+        generator = self.generator()
+        numbers = [generator() for _ in range(5000)]
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(sorted(numbers), numbers)
+
+    def test_processes_lease_different_nodes(self):
+        first, second = self.generator(), self.generator()
+        self.assertNotEqual(first.node_id, second.node_id)
+        self.assertEqual(
+            dict(OrderNumberNode.objects.values_list('node', 'holder')),
+            {first.node_id: first.holder, second.node_id: second.holder},
+        )
+
+    @override_settings(ORDER_NUMBER_NODE=7)
+    def test_configured_node_held_elsewhere_fails_loudly(self):
+        self.assertEqual(self.generator().node_id, 7)
+        with self.assertRaisesMessage(ImproperlyConfigured, 'node 7 is already leased'):
+            SnowflakeGenerator()()
+
+    def test_expired_lease_is_taken_over_and_its_holder_moves_on(self):
+        first = self.generator()
+        OrderNumberNode.objects.update(expires_at=timezone.now())
+        second = self.generator()
+        self.assertEqual(second.node_id, first.node_id)
+        # Time for the first process to renew: its node is gone
+        first.renew_at = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            first()
+        self.assertNotEqual(first.node_id, second.node_id)
+
+    def test_claims_rolled_back_with_their_transaction_are_made_again(self):
+        generator = SnowflakeGenerator()
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            generator()
+            1 / 0
+        self.assertFalse(OrderNumberNode.objects.exists())
+        generator()
+        self.assertEqual(OrderNumberNode.objects.get().holder, generator.holder)
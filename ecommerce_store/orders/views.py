@@ -1,49 +1,79 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db import transaction
+from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch
 from decimal import Decimal
 from .models import Order, OrderItem
+from .placement import OutOfStock, place_order
+from .reservations import reserve
+from .tasks import order_placed
 from cart.models import Cart, CartItem
+from cart.badge import remember
 from cart.views import get_or_create_cart
 import uuid
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+ORDERS_PER_PAGE = 10
+
+CHECKOUT_TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+def checkout_token(request):
+    """The token posted back by the checkout form, or a fresh one"""
+    token = request.POST.get('checkout_token', '')
+    return token if CHECKOUT_TOKEN_RE.match(token) else uuid.uuid4().hex
+
+def order_for_token(user, token):
+    return Order.objects.filter(user=user, checkout_token=token).values_list('order_number', flat=True).first()
+
 @login_required
 def checkout(request):
+    token = checkout_token(request)
+    if request.method == 'POST':
+        # A replayed submission (double click, retry after a timeout) goes
+        # straight to the order it created, without locking or writing
+        order_number = order_for_token(request.user, token)
+        if order_number:
+            return redirect('orders:order_success', order_number=order_number)
+    
     cart = get_or_create_cart(request)
-    cart_items = cart.items.all()
+    cart_items = cart.items.select_related('product')
     
     if not cart_items:
         messages.error(request, 'Your cart is empty.')
         return redirect('cart:cart_detail')
     
     if request.method == 'POST':
+        # Validate required fields
+        required_fields = ['first_name', 'last_name', 'email', 'phone', 
+                         'address_line_1', 'city', 'state', 'postal_code', 'country']
+        
+        for field in required_fields:
+            if not request.POST.get(field, '').strip():
+                messages.error(request, f'{field.replace("_", " ").title()} is required.')
+                return render(request, 'orders/checkout.html', {
+                    'cart': cart,
+                    'cart_items': cart_items,
+                    'checkout_token': token,
+                })
+        
         try:
             with transaction.atomic():
-                # Validate required fields
-                required_fields = ['first_name', 'last_name', 'email', 'phone', 
-                                 'address_line_1', 'city', 'state', 'postal_code', 'country']
-                
-                for field in required_fields:
-                    if not request.POST.get(field, '').strip():
-                        messages.error(request, f'{field.replace("_", " ").title()} is required.')
-                        return render(request, 'orders/checkout.html', {
-                            'cart': cart,
-                            'cart_items': cart_items,
-                        })
-                
                 # Calculate totals with Decimal for precision
-                subtotal = Decimal(str(cart.total_price))
+                subtotal = cart.summary()['total']
                 tax_rate = Decimal('0.13')  # 13% VAT for Nepal
                 tax_amount = subtotal * tax_rate
                 shipping_cost = Decimal('0.00')  # Free shipping
                 total_amount = subtotal + tax_amount + shipping_cost
                 
-                # Create order
-                order = Order.objects.create(
+                # Create the order and its items, taking stock for every line at once
+                order = place_order(
+                    cart,
+                    cart_items,
                     user=request.user,
                     first_name=request.POST['first_name'].strip(),
                     last_name=request.POST['last_name'].strip(),
@@ -61,42 +91,47 @@ def checkout(request):
                     total_amount=total_amount,
                     notes=request.POST.get('notes', '').strip(),
                     payment_status='pending',  # Change to pending until payment is confirmed
+                    checkout_token=token,
                 )
                 
-                # Create order items
-                for cart_item in cart_items:
-                    # Check if product is still in stock
-                    if cart_item.product.stock_quantity < cart_item.quantity:
-                        messages.error(request, f'Insufficient stock for {cart_item.product.name}')
-                        return render(request, 'orders/checkout.html', {
-                            'cart': cart,
-                            'cart_items': cart_items,
-                        })
-                    
-                    OrderItem.objects.create(
-                        order=order,
-                        product=cart_item.product,
-                        quantity=cart_item.quantity,
-                        price=cart_item.product.effective_price,
-                    )
-                    
-                    # Update product stock
-                    cart_item.product.stock_quantity -= cart_item.quantity
-                    cart_item.product.save()
+                # Confirmation email etc. run in the worker; this only queues one row
+                order_placed.delay(order_id=order.id)
                 
                 # Clear cart
                 cart_items.delete()
+                remember(request, {'items': 0, 'total': Decimal('0.00')})
                 
-                messages.success(request, 'Your order has been placed successfully!')
-                return redirect('orders:order_success', order_number=order.order_number)
-                
+            messages.success(request, 'Your order has been placed successfully!')
+            return redirect('orders:order_success', order_number=order.order_number)
+        
+        except OutOfStock as e:
+            messages.error(request, str(e))
+            return render(request, 'orders/checkout.html', {
+                'cart': cart,
+                'cart_items': cart_items,
+                'checkout_token': token,
+            })
+        except IntegrityError:
+            # A concurrent submission with the same token placed the order
+            order_number = order_for_token(request.user, token)
+            if order_number:
+                return redirect('orders:order_success', order_number=order_number)
+            logger.exception("Order processing error")
+            messages.error(request, 'There was an error processing your order. Please try again.')
         except Exception as e:
             logger.error(f"Order processing error: {str(e)}")
             messages.error(request, 'There was an error processing your order. Please try again.')
             # Don't return here, let it fall through to render the form again
     
+    # Hold the stock while the shopper fills in the form
+    shortages = reserve(cart, cart_items)
+    if shortages:
+        for product, available in shortages:
+            messages.error(request, f'Only {available} of {product.name} available right now.')
+        return redirect('cart:cart_detail')
+    
     # Calculate totals for display
-    subtotal = cart.total_price if hasattr(cart, 'total_price') else sum(item.total_price for item in cart_items)
+    subtotal = cart.total_price
     tax_rate = 13  # 13% for display
     tax_amount = subtotal * Decimal('0.13')
     shipping_cost = Decimal('0.00')
@@ -110,6 +145,7 @@ def checkout(request):
         'tax_amount': tax_amount,
         'shipping_cost': shipping_cost,
         'total_amount': total_amount,
+        'checkout_token': token,
     }
     return render(request, 'orders/checkout.html', context)
 
@@ -157,10 +193,23 @@ def order_success(request, order_number):
 
 @login_required
 def order_list(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'orders/order_list.html', {'orders': orders})
+    # One COUNT for the paginator and one annotated query for the page,
+    # however long the history is
+    orders = (
+        Order.objects.filter(user=request.user)
+        .annotate(item_count=Count('items'))
+        .order_by('-created_at', '-id')
+    )
+    page_obj = Paginator(orders, ORDERS_PER_PAGE).get_page(request.GET.get('page'))
+    return render(request, 'orders/order_list.html', {'orders': page_obj})
 
 @login_required
 def order_detail(request, order_number):
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
+    order = get_object_or_404(
+        Order.objects.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product__category'))
+        ),
+        order_number=order_number,
+        user=request.user,
+    )
     return render(request, 'orders/order_detail.html', {'order': order})
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, Review
+from .models import Category, Product, ProductImage, Review, ImageRendition
 
 # Enhanced admin registration with custom admin classes
 
@@ -23,7 +23,7 @@ class ProductAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['price', 'discount_price', 'stock_quantity', 'stock_status', 'is_active', 'is_featured']
     inlines = [ProductImageInline]
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['avg_rating', 'review_count', 'created_at', 'updated_at']
     
     fieldsets = (
         ('Basic Information', {
@@ -44,6 +44,10 @@ class ProductAdmin(admin.ModelAdmin):
         ('Status', {
             'fields': ('is_active', 'is_featured')
         }),
+        ('Ratings', {
+            'fields': ('avg_rating', 'review_count'),
+            'classes': ('collapse',)
+        }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -61,4 +65,11 @@ class ReviewAdmin(admin.ModelAdmin):
     list_display = ['product', 'user', 'rating', 'created_at']
     list_filter = ['rating', 'created_at']
     search_fields = ['product__name', 'user__username', 'comment']
-    readonly_fields = ['created_at']
\ No newline at end of file
+    readonly_fields = ['created_at']
+
+@admin.register(ImageRendition)
+class ImageRenditionAdmin(admin.ModelAdmin):
+    list_display = ['source', 'spec', 'status', 'width', 'height', 'updated_at']
+    list_filter = ['status', 'spec']
+    search_fields = ['source']
+    readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,203 @@
+"""
+In-process BM25 relevance scoring for product search.
+
+The database decides which products match; this index decides how well.
+Each term maps to a pair of NumPy arrays (document slots, weighted term
+frequencies), with name matches counted NAME_WEIGHT times. Query terms are
+expanded to every vocabulary term they prefix, mirroring the prefix matching
+of the FTS backend. Like the suggest index it is a live_index.LiveIndex:
+built off the request path, patched from post-commit signals and rebuilt in
+the background every REFRESH_SECONDS.
+
+NumPy is optional: without it `available()` is False and search falls back
+to the database's own ranking.
+"""
+import bisect
+import math
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .live_index import LiveIndex
+from .models import Product
+from .search import tokenize
+
+K1 = 1.2
+B = 0.75
+NAME_WEIGHT = 3.0
+SHORT_DESCRIPTION_WEIGHT = 1.5
+DESCRIPTION_WEIGHT = 1.0
+MAX_PREFIX_EXPANSION = 20
+REFRESH_SECONDS = 300
+
+
+def available():
+    return np is not None
+
+
+def weighted_terms(name, short_description, description):
+    """{term: weighted frequency}, weighted document length"""
+    counts = {}
+    for text, weight in ((name, NAME_WEIGHT), (short_description, SHORT_DESCRIPTION_WEIGHT),
+                         (description, DESCRIPTION_WEIGHT)):
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0.0) + weight
+    return counts, sum(counts.values())
+
+
+class Postings:
+    """The index data; changed in place, always under BM25Index.lock"""
+
+    def __init__(self, capacity=1024):
+        self.postings = {}          # term -> (slots int32 array, tf float32 array)
+        self.vocabulary = []        # sorted terms, for prefix expansion
+        self.slot_of = {}           # product id -> slot
+        self.product_ids = np.zeros(capacity, dtype=np.int64)
+        self.doc_len = np.zeros(capacity, dtype=np.float32)
+        self.doc_terms = {}         # slot -> terms, for incremental removal
+        self.free_slots = []
+        self.next_slot = 0
+        self.total_len = 0.0
+        self.doc_count = 0
+
+    @classmethod
+    def load(cls):
+        state = cls()
+        rows = (
+            Product.objects.filter(is_active=True)
+            .values_list('id', 'name', 'short_description', 'description')
+            .iterator(chunk_size=2000)
+        )
+        postings = {}
+        for product_id, name, short_description, description in rows:
+            for term, tf, slot in state._add_document(product_id, name, short_description, description):
+                slots, tfs = postings.setdefault(term, ([], []))
+                slots.append(slot)
+                tfs.append(tf)
+        state.postings = {
+            term: (np.array(slots, dtype=np.int32), np.array(tfs, dtype=np.float32))
+            for term, (slots, tfs) in postings.items()
+        }
+        state.vocabulary = sorted(state.postings)
+        return state
+
+    def _slot(self, product_id):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = self.next_slot
+            self.next_slot += 1
+            if slot >= len(self.doc_len):
+                size = len(self.doc_len) * 2
+                self.product_ids = np.resize(self.product_ids, size)
+                self.doc_len = np.resize(self.doc_len, size)
+        self.slot_of[product_id] = slot
+        self.product_ids[slot] = product_id
+        return slot
+
+    def _add_document(self, product_id, name, short_description, description):
+        """Take a slot for the product; yields (term, tf, slot) to post"""
+        counts, length = weighted_terms(name, short_description, description)
+        slot = self._slot(product_id)
+        self.doc_len[slot] = length
+        self.doc_terms[slot] = list(counts)
+        self.total_len += length
+        self.doc_count += 1
+        for term, tf in counts.items():
+            yield term, tf, slot
+
+    def add(self, product_id, name, short_description, description):
+        for term, tf, slot in self._add_document(product_id, name, short_description, description):
+            if term in self.postings:
+                slots, tfs = self.postings[term]
+                self.postings[term] = (np.append(slots, np.int32(slot)), np.append(tfs, np.float32(tf)))
+            else:
+                self.postings[term] = (np.array([slot], dtype=np.int32), np.array([tf], dtype=np.float32))
+                bisect.insort(self.vocabulary, term)
+
+    def remove(self, product_id):
+        slot = self.slot_of.pop(product_id, None)
+        if slot is None:
+            return
+        for term in self.doc_terms.pop(slot, []):
+            slots, tfs = self.postings[term]
+            keep = slots != slot
+            if keep.any():
+                self.postings[term] = (slots[keep], tfs[keep])
+            else:
+                del self.postings[term]
+                position = bisect.bisect_left(self.vocabulary, term)
+                if position < len(self.vocabulary) and self.vocabulary[position] == term:
+                    del self.vocabulary[position]
+        self.total_len -= float(self.doc_len[slot])
+        self.doc_len[slot] = 0
+        self.doc_count -= 1
+        self.free_slots.append(slot)
+
+    def _expand(self, token):
+        terms = []
+        position = bisect.bisect_left(self.vocabulary, token)
+        while position < len(self.vocabulary) and len(terms) < MAX_PREFIX_EXPANSION:
+            term = self.vocabulary[position]
+            if not term.startswith(token):
+                break
+            terms.append(term)
+            position += 1
+        return terms
+
+    def scores(self, query, product_ids):
+        """{product id: score} for the given products"""
+        slots = np.array([self.slot_of[pk] for pk in product_ids if pk in self.slot_of], dtype=np.int64)
+        if not len(slots):
+            return {}
+        scores = np.zeros(self.next_slot, dtype=np.float32)
+        avg_len = self.total_len / self.doc_count
+        norm = K1 * (1 - B + B * self.doc_len[:self.next_slot] / avg_len)
+        for token in set(tokenize(query)):
+            for term in self._expand(token):
+                term_slots, tfs = self.postings[term]
+                idf = math.log(1 + (self.doc_count - len(term_slots) + 0.5) / (len(term_slots) + 0.5))
+                # slots are unique within a posting list, so fancy-index += is safe
+                scores[term_slots] += idf * tfs * (K1 + 1) / (tfs + norm[term_slots])
+        return {int(pk): float(score) for pk, score in zip(self.product_ids[slots], scores[slots])}
+
+
+class BM25Index(LiveIndex):
+    REFRESH_SECONDS = REFRESH_SECONDS
+
+    def load(self):
+        return Postings.load()
+
+    def apply(self, state, change):
+        product_id, fields = change
+        state.remove(product_id)
+        if fields is not None:
+            state.add(product_id, *fields)
+        return state
+
+    def update_product(self, product):
+        if not available():
+            return
+        fields = (product.name, product.short_description, product.description) if product.is_active else None
+        self.change((product.pk, fields))
+
+    def remove_product(self, product_id):
+        if available():
+            self.change((product_id, None))
+
+    def refresh(self, wait=False):
+        if available():
+            super().refresh(wait)
+
+    def scores(self, query, product_ids):
+        """{product id: BM25 score} for the given (matching) products"""
+        if not available():
+            return {}
+        self.ensure_fresh()
+        with self.lock:
+            return self.state.scores(query, product_ids)
+
+
+index = BM25Index()
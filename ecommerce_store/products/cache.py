@@ -0,0 +1,75 @@
+"""
+Versioned read-through cache for catalog listings.
+
+Every key embeds a global catalog version. Saving or deleting catalog data
+bumps the version once the transaction commits, which orphans every cached
+listing at once. The version is read *before* the database is queried, so a
+request racing a commit can only store its (old) result under the old
+version and a page can never show a price that was stale at commit time.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 600
+VERSION_KEY = 'catalog:version'
+
+
+def get_cache():
+    alias = CATALOG_CACHE_ALIAS if CATALOG_CACHE_ALIAS in settings.CACHES else 'default'
+    return caches[alias]
+
+
+def catalog_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses an old version
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def bump_on_commit():
+    transaction.on_commit(bump_catalog_version)
+
+
+def catalog_key(view, params, version=None):
+    if version is None:
+        version = catalog_version()
+    digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f'catalog:{version}:{view}:{digest}'
+
+
+def cached(view, params, builder, timeout=CATALOG_CACHE_TIMEOUT):
+    """Return the cached value for (view, params), calling builder() on a miss"""
+    cache = get_cache()
+    key = catalog_key(view, params)
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, timeout)
+    return value
+
+
+def cached_page(paginator, cursor, view, params):
+    """Read-through cache for one CursorPaginator page"""
+    def build():
+        page = paginator.get_page(cursor)
+        return page.object_list, page.has_next(), page.has_previous()
+
+    object_list, has_next, has_previous = cached(view, dict(params, cursor=cursor), build)
+    return paginator.page_class(object_list, paginator, has_next, has_previous)
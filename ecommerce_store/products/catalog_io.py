@@ -0,0 +1,116 @@
+"""
+Row formats shared by the import_products / export_products commands.
+
+A catalog file is CSV (with a header) or JSON Lines, one product per row,
+keyed on `sku`. `category` holds the category slug; `category_name` is only
+used when the import has to create that category.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.utils.text import slugify
+
+from .models import Product
+
+EXPORT_FIELDS = [
+    'sku', 'name', 'slug', 'category', 'category_name', 'short_description', 'description',
+    'price', 'discount_price', 'stock_quantity', 'stock_status', 'weight',
+    'is_active', 'is_featured', 'image',
+]
+
+# Product columns written by an import, apart from the category FK
+IMPORT_FIELDS = [
+    'name', 'slug', 'short_description', 'description', 'price', 'discount_price',
+    'stock_quantity', 'stock_status', 'weight', 'is_active', 'is_featured', 'image',
+]
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+STOCK_STATUSES = {key for key, _ in Product.STOCK_STATUS}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict) pairs without loading the whole file"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    row = RowError(str(e))
+                if not isinstance(row, (dict, RowError)):
+                    row = RowError('expected a JSON object')
+                yield line_number, row
+
+
+def _decimal(value, required=False):
+    if value in (None, ''):
+        if required:
+            raise RowError('missing required decimal')
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f'invalid decimal: {value!r}')
+    if not number.is_finite() or number < 0:
+        raise RowError(f'invalid decimal: {value!r}')
+    return number
+
+
+def _bool(value, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+def clean_row(row):
+    """Validate one input row and return the values to store"""
+    if isinstance(row, RowError):
+        raise row
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    category = str(row.get('category') or '').strip()
+    if not sku or not name or not category:
+        raise RowError('sku, name and category are required')
+    if len(sku) > 50 or len(name) > 200:
+        raise RowError('sku or name is too long')
+    try:
+        stock_quantity = int(row.get('stock_quantity') or 0)
+    except (TypeError, ValueError):
+        raise RowError(f"invalid stock_quantity: {row.get('stock_quantity')!r}")
+    stock_status = str(row.get('stock_status') or 'in_stock').strip()
+    if stock_status not in STOCK_STATUSES:
+        raise RowError(f'invalid stock_status: {stock_status!r}')
+    return {
+        'sku': sku,
+        'name': name,
+        'slug': str(row.get('slug') or '').strip() or slugify(f'{name}-{sku}')[:200],
+        'category': category,
+        'category_name': str(row.get('category_name') or '').strip() or category.replace('-', ' ').title(),
+        'short_description': str(row.get('short_description') or '')[:300],
+        'description': str(row.get('description') or ''),
+        'price': _decimal(row.get('price'), required=True),
+        'discount_price': _decimal(row.get('discount_price')),
+        'stock_quantity': max(stock_quantity, 0),
+        'stock_status': stock_status,
+        'weight': _decimal(row.get('weight')) or Decimal('0'),
+        'is_active': _bool(row.get('is_active'), True),
+        'is_featured': _bool(row.get('is_featured'), False),
+        'image': str(row.get('image') or ''),
+    }
@@ -0,0 +1,52 @@
+"""
+Conditional GET (ETag) for catalog pages.
+
+Validators are computed from data the view already has in hand, so a
+matching request is answered with 304 before any template is rendered. The
+ETag covers everything that varies the HTML: the catalog version, the URL,
+the products' updated_at, and the per-visitor parts of base.html (user and
+cart badge). There is no Last-Modified: the newest updated_at on a page
+doesn't move when a product is deleted or deactivated, so If-Modified-Since
+would keep confirming a stale listing. The catalog version in the ETag is
+bumped for those changes.
+"""
+import hashlib
+import json
+
+from django.contrib.messages import get_messages
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from cart.context_processors import cart as cart_badge
+
+from .cache import catalog_version
+
+
+def page_etag(request, objects):
+    badge = cart_badge(request)
+    parts = [
+        catalog_version(),
+        request.get_full_path(),
+        [obj.updated_at.isoformat() for obj in objects],
+        request.user.pk if request.user.is_authenticated else None,
+        badge['cart_items'],
+        str(badge['cart_total']),
+    ]
+    return '"%s"' % hashlib.md5(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def conditional_render(request, template_name, context, objects):
+    """render() that answers a matching If-None-Match with a 304"""
+    # Flash messages make the page one-off; never validate it
+    if len(get_messages(request)):
+        return render(request, template_name, context)
+
+    etag = page_etag(request, objects)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render(request, template_name, context)
+
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
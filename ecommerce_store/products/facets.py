@@ -0,0 +1,126 @@
+"""
+Faceted navigation for the product list.
+
+All facet counts come from a single aggregate query using conditional
+Count(filter=...) expressions. Each facet is counted with every *other*
+selected facet applied, so picking a category still shows how many results
+the sibling categories would give.
+"""
+from django.db.models import Count, F, Q
+
+from .models import Product
+
+PRICE_BUCKETS = [
+    ('under-500', 'Under Rs500', None, 500),
+    ('500-1000', 'Rs500 - Rs1000', 500, 1000),
+    ('1000-5000', 'Rs1000 - Rs5000', 1000, 5000),
+    ('5000-plus', 'Rs5000 & above', 5000, None),
+]
+
+FACET_PARAMS = ('category', 'price', 'stock', 'on_sale', 'featured')
+
+
+def price_bucket_q(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(effective_price__gte=low)
+    if high is not None:
+        condition &= Q(effective_price__lt=high)
+    return condition
+
+
+ON_SALE_Q = Q(discount_price__isnull=False, discount_price__lt=F('price'))
+
+
+class FacetSelection:
+    """The facet values picked in a request's query string"""
+
+    def __init__(self, params, categories):
+        by_slug = {category.slug: category for category in categories}
+        self.unknown_categories = [slug for slug in params.getlist('category') if slug and slug not in by_slug]
+        self.categories = [by_slug[slug] for slug in params.getlist('category') if slug in by_slug]
+        buckets = {key for key, *_ in PRICE_BUCKETS}
+        self.prices = [key for key in params.getlist('price') if key in buckets]
+        statuses = {key for key, _ in Product.STOCK_STATUS}
+        self.stock = [key for key in params.getlist('stock') if key in statuses]
+        self.on_sale = params.get('on_sale') == '1'
+        self.featured = params.get('featured') == '1'
+
+    def as_params(self):
+        return {
+            'category': sorted(category.slug for category in self.categories),
+            'price': sorted(self.prices),
+            'stock': sorted(self.stock),
+            'on_sale': self.on_sale,
+            'featured': self.featured,
+        }
+
+    def filters(self):
+        """{facet name: Q} for every facet with a selection"""
+        filters = {}
+        if self.categories:
+            filters['category'] = Q(category_id__in=[category.id for category in self.categories])
+        if self.prices:
+            condition = Q()
+            for key, _, low, high in PRICE_BUCKETS:
+                if key in self.prices:
+                    condition |= price_bucket_q(low, high)
+            filters['price'] = condition
+        if self.stock:
+            filters['stock'] = Q(stock_status__in=self.stock)
+        if self.on_sale:
+            filters['on_sale'] = ON_SALE_Q
+        if self.featured:
+            filters['featured'] = Q(is_featured=True)
+        return filters
+
+
+def combine(filters, exclude=None):
+    condition = Q()
+    for name, facet_q in filters.items():
+        if name != exclude:
+            condition &= facet_q
+    return condition
+
+
+def apply_facets(queryset, selection):
+    return queryset.filter(combine(selection.filters()))
+
+
+def facet_counts(queryset, selection, categories):
+    """
+    Count every facet value over `queryset` (base filters such as is_active
+    and search already applied) in one query.
+    """
+    filters = selection.filters()
+    aggregates = {}
+    for category in categories:
+        aggregates[f'category_{category.id}'] = Count(
+            'id', filter=Q(category_id=category.id) & combine(filters, 'category')
+        )
+    for key, _, low, high in PRICE_BUCKETS:
+        aggregates[f'price_{key}'] = Count('id', filter=price_bucket_q(low, high) & combine(filters, 'price'))
+    for key, _ in Product.STOCK_STATUS:
+        aggregates[f'stock_{key}'] = Count('id', filter=Q(stock_status=key) & combine(filters, 'stock'))
+    aggregates['on_sale'] = Count('id', filter=ON_SALE_Q & combine(filters, 'on_sale'))
+    aggregates['featured'] = Count('id', filter=Q(is_featured=True) & combine(filters, 'featured'))
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    selected_ids = {category.id for category in selection.categories}
+    return {
+        'category': [
+            {'value': category.slug, 'label': category.name,
+             'count': counts[f'category_{category.id}'], 'selected': category.id in selected_ids}
+            for category in categories
+        ],
+        'price': [
+            {'value': key, 'label': label, 'count': counts[f'price_{key}'], 'selected': key in selection.prices}
+            for key, label, _, _ in PRICE_BUCKETS
+        ],
+        'stock': [
+            {'value': key, 'label': label, 'count': counts[f'stock_{key}'], 'selected': key in selection.stock}
+            for key, label in Product.STOCK_STATUS
+        ],
+        'on_sale': {'count': counts['on_sale'], 'selected': selection.on_sale},
+        'featured': {'count': counts['featured'], 'selected': selection.featured},
+    }
@@ -0,0 +1,104 @@
+"""
+Rebuild machinery shared by the in-process indexes (suggest.py, bm25.py).
+
+An index keeps its data in `self.state`. A rebuild loads a whole new state
+from the database without holding any lock and swaps it in; changes that
+arrive from post-commit signals while it loads are queued and replayed onto
+the new state, so none are lost. Only one rebuild runs at a time. Lookups
+call ensure_fresh(): the very first one waits for the initial build (which
+the web server starts at startup, see wsgi.py), later ones only start a
+background rebuild once the state is REFRESH_SECONDS old and carry on with
+the current state.
+"""
+import logging
+import threading
+import time
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class LiveIndex:
+    REFRESH_SECONDS = 300
+
+    def __init__(self):
+        self.state = None
+        self.built_at = None
+        # Guards self.state and self.pending
+        self.lock = threading.Lock()
+        # Held for the whole of a rebuild, so only one runs at a time
+        self.build_lock = threading.Lock()
+        self.pending = None
+
+    def load(self):
+        """Return a new state read from the database"""
+        raise NotImplementedError
+
+    def apply(self, state, change):
+        """Return `state` with `change` applied (in place or as a copy)"""
+        raise NotImplementedError
+
+    def build(self):
+        """Rebuild now, waiting for any rebuild already in progress"""
+        with self.build_lock:
+            self._build()
+
+    def _build(self):
+        with self.lock:
+            self.pending = []
+        try:
+            state = self.load()
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+        with self.lock:
+            for change in self.pending:
+                state = self.apply(state, change)
+            self.pending = None
+            self.state = state
+            self.built_at = time.monotonic()
+
+    def refresh(self, wait=False):
+        """
+        Rebuild unless a rebuild is already running. With wait=False the work
+        happens on a background thread and this returns immediately.
+        """
+        if not self.build_lock.acquire(blocking=wait):
+            return
+        if wait:
+            try:
+                self._build()
+            finally:
+                self.build_lock.release()
+            return
+
+        def run():
+            try:
+                self._build()
+            except Exception:
+                logger.exception(f'Rebuilding {type(self).__name__} failed')
+            finally:
+                self.build_lock.release()
+                connection.close()
+
+        threading.Thread(target=run, name=type(self).__name__, daemon=True).start()
+
+    def ensure_fresh(self):
+        if self.built_at is None:
+            # Nothing to answer from yet: wait for the first build, started
+            # at startup or by whichever request got here first
+            with self.build_lock:
+                if self.built_at is None:
+                    self._build()
+        elif time.monotonic() - self.built_at > self.REFRESH_SECONDS:
+            self.refresh()
+
+    def change(self, change):
+        """Apply a change from this process to the live state"""
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(change)
+            if self.state is not None:
+                self.state = self.apply(self.state, change)
@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from orders.models import OrderItem
+from products.cache import bump_catalog_version
+from products.models import ProductNeighbor
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the co-purchase "related products" table from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Neighbours to keep per product')
+        parser.add_argument('--days', type=int, default=None, help='Only use orders from the last N days')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        top, batch_size = options['top'], options['batch_size']
+
+        # Pairs of distinct products bought in the same order, scored by the
+        # number of orders containing both. Sorted so each product's pairs
+        # arrive together, best first.
+        items = OrderItem.objects.all()
+        if options['days']:
+            items = items.filter(order__created_at__gte=timezone.now() - timedelta(days=options['days']))
+        pairs = (
+            items.annotate(other_id=F('order__items__product_id'))
+            .exclude(product_id=F('other_id'))
+            .values('product_id', 'other_id')
+            .annotate(score=Count('order_id', distinct=True))
+            .order_by('product_id', '-score', 'other_id')
+        )
+
+        rows = 0
+        with transaction.atomic():
+            ProductNeighbor.objects.all().delete()
+            batch, current, rank = [], None, 0
+            for pair in pairs.iterator(chunk_size=batch_size):
+                if pair['product_id'] != current:
+                    current, rank = pair['product_id'], 0
+                if rank >= top:
+                    continue
+                rank += 1
+                batch.append(ProductNeighbor(
+                    product_id=pair['product_id'], neighbor_id=pair['other_id'],
+                    score=pair['score'], rank=rank,
+                ))
+                if len(batch) >= batch_size:
+                    ProductNeighbor.objects.bulk_create(batch)
+                    rows += len(batch)
+                    batch = []
+            ProductNeighbor.objects.bulk_create(batch)
+            rows += len(batch)
+        bump_catalog_version()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Stored {rows} related-product rows in {elapsed:.1f}s'))
@@ -0,0 +1,58 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_io import EXPORT_FIELDS, detect_format
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Stream all products to a CSV or JSONL file with flat memory use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, or '-' for stdout")
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = detect_format(path, options['format'])
+        columns = [field for field in EXPORT_FIELDS if field not in ('category', 'category_name')]
+        rows = (
+            Product.objects.order_by('id')
+            .values(*columns, 'category__slug', 'category__name')
+            .iterator(chunk_size=options['chunk_size'])
+        )
+
+        try:
+            stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        started = time.monotonic()
+        count = 0
+        try:
+            writer = None
+            if fmt == 'csv':
+                writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+                writer.writeheader()
+            for row in rows:
+                row['category'] = row.pop('category__slug')
+                row['category_name'] = row.pop('category__name')
+                if writer:
+                    writer.writerow(row)
+                else:
+                    stream.write(json.dumps(row, default=str) + '\n')
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = time.monotonic() - started
+        rate = count / elapsed if elapsed else count
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {count} products in {elapsed:.1f}s - {rate:.0f} rows/sec'
+        ))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import renditions
+
+
+class Command(BaseCommand):
+    help = 'Generate queued image renditions (thumbnail, card, detail and WebP variants)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            batch = renditions.claim_batch(options['batch_size'])
+            if batch:
+                total += renditions.process(batch)
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Generated {total} renditions'))
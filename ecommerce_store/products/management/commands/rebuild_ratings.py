@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import bump_catalog_version
+from products.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored review aggregates (rating_sum, review_count, avg_rating) for all products'
+
+    def handle(self, *args, **options):
+        count = rebuild_ratings()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt ratings for {count} products'))
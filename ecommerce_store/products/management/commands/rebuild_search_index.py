@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def handle(self, *args, **options):
+        engine = search.backend()
+        if engine != 'sqlite':
+            self.stdout.write(f'Nothing to rebuild for backend: {engine or "fallback"}')
+            return
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
@@ -1,7 +1,6 @@
 from django.db import models
 from django.urls import reverse
 from django.contrib.auth.models import User
-from PIL import Image
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -35,6 +34,16 @@ class Product(models.Model):
     short_description = models.CharField(max_length=300)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # The price customers actually pay, computed and stored by the database so
+    # it can be sorted, filtered and summed in SQL
+    effective_price = models.GeneratedField(
+        expression=models.Case(
+            models.When(discount_price__lt=models.F('price'), then=models.F('discount_price')),
+            default=models.F('price'),
+        ),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
     image = models.ImageField(upload_to='products/')
     stock_quantity = models.PositiveIntegerField(default=0)
     stock_status = models.CharField(max_length=20, choices=STOCK_STATUS, default='in_stock')
@@ -42,14 +51,29 @@ class Product(models.Model):
     weight = models.DecimalField(max_digits=5, decimal_places=2, default=0.0)
     is_active = models.BooleanField(default=True)
     is_featured = models.BooleanField(default=False)
+    # Review aggregates, kept current by products.ratings
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    avg_rating = models.FloatField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Written only through F() updates; a regular save must never overwrite them
+    AGGREGATE_FIELDS = ('rating_sum', 'review_count', 'avg_rating')
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['slug']),
             models.Index(fields=['category', 'is_active']),
+            models.Index(fields=['category', 'is_active', 'effective_price'], name='product_cat_active_price_idx'),
+            # Keyset pagination: one index per catalog sort order
+            models.Index(fields=['is_active', '-created_at', 'id'], name='product_active_newest_idx'),
+            models.Index(fields=['is_active', 'effective_price', 'id'], name='product_active_price_idx'),
+            models.Index(fields=['is_active', 'name', 'id'], name='product_active_name_idx'),
+            # Facet filters
+            models.Index(fields=['is_active', 'stock_status'], name='product_active_stock_idx'),
+            models.Index(fields=['is_active', 'is_featured'], name='product_active_featured_idx'),
         ]
 
     def __str__(self):
@@ -62,10 +86,6 @@ class Product(models.Model):
     def is_on_sale(self):
         return self.discount_price and self.discount_price < self.price
 
-    @property
-    def effective_price(self):
-        return self.discount_price if self.is_on_sale else self.price
-
     @property
     def sale_percentage(self):
         if self.is_on_sale:
@@ -73,13 +93,19 @@ class Product(models.Model):
         return 0
 
     def save(self, *args, **kwargs):
+        updating = not self._state.adding
+        if updating and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated
+                and field.name not in self.AGGREGATE_FIELDS
+            ]
+        # Resized copies are produced after commit by products.renditions
         super().save(*args, **kwargs)
-        if self.image:
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(self.image.path)
+        if updating:
+            # UPDATE doesn't return generated columns; defer so the next
+            # access reloads effective_price
+            self.__dict__.pop('effective_price', None)
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
@@ -110,4 +136,62 @@ class Review(models.Model):
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"{self.product.name} - {self.rating} Stars"
\ No newline at end of file
+        return f"{self.product.name} - {self.rating} Stars"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored state so edits can apply a rating delta
+        instance._loaded_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+
+class ProductNeighbor(models.Model):
+    """
+    Top-N "customers also bought" neighbours of a product, precomputed from
+    order history by the build_related_products command.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('product', 'neighbor')
+        ordering = ['product', 'rank']
+        indexes = [
+            models.Index(fields=['product', 'rank']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.neighbor_id} ({self.score})"
+
+class ImageRendition(models.Model):
+    """
+    A resized copy of an uploaded image. Rows are created as 'pending' after
+    the upload commits and double as the work queue for process_renditions.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
+    source = models.CharField(max_length=255)
+    spec = models.CharField(max_length=30)
+    file = models.CharField(max_length=255, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'spec')
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.source} [{self.spec}]"
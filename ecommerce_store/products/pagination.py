@@ -0,0 +1,158 @@
+"""
+Keyset (cursor) pagination for the catalog views.
+
+Pages are fetched with a WHERE clause on the sort key of the last row seen
+instead of OFFSET, so page 500 costs the same as page 1. Cursors are opaque
+url-safe tokens encoding the boundary row's sort values.
+"""
+import base64
+import json
+from functools import cached_property
+
+from django.db.models import Q
+
+from .cache import catalog_key, get_cache
+
+COUNT_CACHE_TIMEOUT = 300
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': values, 'd': direction}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (values, direction) or None for a missing or malformed token"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, direction = payload['v'], payload['d']
+    except (ValueError, TypeError, KeyError):
+        return None
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        return None
+    return values, direction
+
+
+class CursorPage:
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.cursor_for(self.object_list[-1], 'next')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.cursor_for(self.object_list[0], 'prev')
+        return None
+
+
+class CursorPaginator:
+    """
+    Paginate `queryset` by `ordering`, a tuple of field names (optionally
+    prefixed with '-') that must end in a unique column such as 'id'.
+    """
+    page_class = CursorPage
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    @cached_property
+    def count(self):
+        # Approximate total: cached per distinct filter set and catalog version
+        # so that listing pages don't run COUNT(*) on every request.
+        query = self.queryset.order_by()
+        if query.query.is_empty():
+            # e.g. a search with no searchable terms; its SQL can't be rendered
+            return 0
+        key = catalog_key('count', str(query.query))
+        return get_cache().get_or_set(key, query.count, COUNT_CACHE_TIMEOUT)
+
+    def cursor_for(self, obj, direction):
+        return encode_cursor([getattr(obj, field) for field in self.fields], direction)
+
+    def _to_python(self, values):
+        model = self.queryset.model
+        converted = []
+        for field, value in zip(self.fields, values):
+            try:
+                value = model._meta.get_field(field).to_python(value)
+            except Exception:
+                # Annotations (e.g. search_rank) aren't model fields
+                pass
+            converted.append(value)
+        return converted
+
+    def _seek(self, values, forward):
+        # (a, b, c) > (x, y, z) expanded into OR-of-ANDs so mixed ASC/DESC
+        # orderings still match an index prefix.
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            field = self.fields[i]
+            descending = name.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            clause = Q(**{f'{field}__{lookup}': values[i]})
+            for j in range(i):
+                clause &= Q(**{self.fields[j]: values[j]})
+            condition |= clause
+        return condition
+
+    def get_page(self, cursor=None):
+        decoded = decode_cursor(cursor)
+        if decoded and len(decoded[0]) != len(self.fields):
+            decoded = None
+
+        if decoded is None:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            return self.page_class(rows[:self.per_page], self, len(rows) > self.per_page, False)
+
+        values, direction = decoded
+        values = self._to_python(values)
+        if direction == 'next':
+            rows = list(
+                self.queryset.filter(self._seek(values, True))
+                .order_by(*self.ordering)[:self.per_page + 1]
+            )
+            return self.page_class(rows[:self.per_page], self, len(rows) > self.per_page, True)
+
+        reverse = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+        rows = list(
+            self.queryset.filter(self._seek(values, False))
+            .order_by(*reverse)[:self.per_page + 1]
+        )
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return self.page_class(rows, self, True, has_previous)
@@ -0,0 +1,53 @@
+"""
+Incremental maintenance of the Product review aggregates.
+
+Every change is a single UPDATE built from F() expressions, so concurrent
+reviews never lose an increment.
+"""
+from django.db.models import Avg, Count, F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, Now, NullIf
+
+from .models import Product, Review
+
+
+def apply_review_delta(product_id, rating_delta, count_delta):
+    Product.objects.filter(pk=product_id).update(
+        rating_sum=F('rating_sum') + rating_delta,
+        review_count=F('review_count') + count_delta,
+        avg_rating=Cast(F('rating_sum') + rating_delta, FloatField())
+        / NullIf(F('review_count') + count_delta, 0),
+        # Reviews are part of the product page; keep its ETag honest
+        updated_at=Now(),
+    )
+
+
+def review_saved(review, created):
+    if created:
+        apply_review_delta(review.product_id, review.rating, 1)
+        return
+    old_product_id, old_rating = getattr(review, '_loaded_rating', (None, None))
+    if old_product_id is None:
+        # Not loaded from the database; we can't know the delta
+        rebuild_ratings(Product.objects.filter(pk=review.product_id))
+    elif old_product_id != review.product_id:
+        apply_review_delta(old_product_id, -old_rating, -1)
+        apply_review_delta(review.product_id, review.rating, 1)
+    elif old_rating != review.rating:
+        apply_review_delta(review.product_id, review.rating - old_rating, 0)
+    review._loaded_rating = (review.product_id, review.rating)
+
+
+def review_deleted(review):
+    apply_review_delta(review.product_id, -review.rating, -1)
+
+
+def rebuild_ratings(queryset=None):
+    """Recompute the aggregates in one UPDATE. Returns the number of products."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return queryset.update(
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+        review_count=Coalesce(Subquery(reviews.annotate(total=Count('id')).values('total')), 0),
+        avg_rating=Subquery(reviews.annotate(average=Avg('rating')).values('average')),
+    )
@@ -0,0 +1,155 @@
+"""
+Background image rendition pipeline.
+
+Saving a Product, ProductImage or Category queues one pending ImageRendition
+row per spec once the transaction commits, and puts failed ones back in the
+queue; `manage.py process_renditions`
+drains the queue with PIL. Templates resolve rendition URLs through the
+shared catalog cache (see templatetags/product_images.py) and never open the
+image themselves; the worker drops a source's entry there once its
+renditions are written, so every web process picks them up.
+"""
+import io
+import logging
+import posixpath
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import get_cache
+from .models import ImageRendition
+
+logger = logging.getLogger(__name__)
+
+# name: (max width, max height, PIL format, extension)
+RENDITION_SPECS = {
+    'thumbnail': (150, 150, 'JPEG', 'jpg'),
+    'card': (400, 400, 'JPEG', 'jpg'),
+    'detail': (800, 800, 'JPEG', 'jpg'),
+    'thumbnail_webp': (150, 150, 'WEBP', 'webp'),
+    'card_webp': (400, 400, 'WEBP', 'webp'),
+    'detail_webp': (800, 800, 'WEBP', 'webp'),
+}
+
+CACHE_PREFIX = 'renditions:'
+# Bounds how long a lost invalidation can keep serving the fallback URLs
+CACHE_TIMEOUT = 60 * 60
+STALE_PROCESSING_SECONDS = 600
+
+
+def cache_key(source):
+    return CACHE_PREFIX + source
+
+
+def rendition_name(source, spec):
+    stem = posixpath.splitext(source)[0]
+    return f'renditions/{spec}/{stem}.{RENDITION_SPECS[spec][3]}'
+
+
+def enqueue(source):
+    """Queue every rendition for an uploaded file (no-op if already queued)"""
+    enqueue_many([source])
+
+
+def enqueue_many(sources):
+    """
+    Queue the renditions of every source that has none yet, and put failed
+    ones back in the queue: saving the object again (e.g. after replacing a
+    broken upload) retries them. Pending and ready rows are left alone.
+    """
+    sources = [source for source in sources if source]
+    ImageRendition.objects.filter(source__in=sources, status='failed').update(
+        status='pending', error='', updated_at=timezone.now(),
+    )
+    ImageRendition.objects.bulk_create(
+        [ImageRendition(source=source, spec=spec) for source in sources for spec in RENDITION_SPECS],
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_on_commit(field_file):
+    if field_file:
+        name = field_file.name
+        transaction.on_commit(lambda: enqueue(name))
+
+
+def ready_renditions(source):
+    """{spec: storage name} of finished renditions, cached per source file"""
+    cache = get_cache()
+    renditions = cache.get(cache_key(source))
+    if renditions is None:
+        renditions = dict(
+            ImageRendition.objects.filter(source=source, status='ready').values_list('spec', 'file')
+        )
+        cache.set(cache_key(source), renditions, CACHE_TIMEOUT)
+    return renditions
+
+
+def claim_batch(limit):
+    """Atomically move up to `limit` queued rows to 'processing' and return them"""
+    stale = timezone.now() - timedelta(seconds=STALE_PROCESSING_SECONDS)
+    runnable = Q(status='pending') | Q(status='processing', updated_at__lt=stale)
+    ids = list(
+        ImageRendition.objects.filter(runnable).order_by('created_at').values_list('id', flat=True)[:limit]
+    )
+    if not ids:
+        return []
+    # The status re-check makes the claim safe against concurrent workers
+    ImageRendition.objects.filter(runnable, id__in=ids).update(status='processing', updated_at=timezone.now())
+    return list(ImageRendition.objects.filter(id__in=ids, status='processing').order_by('source'))
+
+
+def render(image, spec):
+    from PIL import Image
+
+    width, height, fmt, _ = RENDITION_SPECS[spec]
+    copy = image.copy()
+    copy.thumbnail((width, height), Image.LANCZOS)
+    if fmt == 'JPEG' and copy.mode not in ('RGB', 'L'):
+        copy = copy.convert('RGB')
+    buffer = io.BytesIO()
+    copy.save(buffer, fmt, quality=85)
+    return copy.size, buffer.getvalue()
+
+
+def process(renditions):
+    """Render a claimed batch, opening each source image only once"""
+    from PIL import Image
+
+    by_source = {}
+    for rendition in renditions:
+        by_source.setdefault(rendition.source, []).append(rendition)
+
+    done = 0
+    for source, items in by_source.items():
+        try:
+            with default_storage.open(source) as fh:
+                image = Image.open(fh)
+                image.load()
+        except Exception as e:
+            logger.error(f"Could not open {source} for renditions: {str(e)}")
+            ImageRendition.objects.filter(id__in=[r.id for r in items]).update(
+                status='failed', error=str(e), updated_at=timezone.now()
+            )
+            continue
+
+        for rendition in items:
+            try:
+                (width, height), data = render(image, rendition.spec)
+                name = rendition_name(source, rendition.spec)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                rendition.file = default_storage.save(name, ContentFile(data))
+                rendition.width, rendition.height = width, height
+                rendition.status, rendition.error = 'ready', ''
+                done += 1
+            except Exception as e:
+                logger.error(f"Rendition {rendition} failed: {str(e)}")
+                rendition.status, rendition.error = 'failed', str(e)
+            rendition.save(update_fields=['file', 'width', 'height', 'status', 'error', 'updated_at'])
+        get_cache().delete(cache_key(source))
+    return done
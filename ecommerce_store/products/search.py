@@ -0,0 +1,164 @@
+"""
+Full-text product search.
+
+On SQLite the catalog is mirrored into an FTS5 table (kept in sync by the
+Product signals), on PostgreSQL a GIN index covers a weighted tsvector
+expression. Other backends fall back to icontains matching. When NumPy is
+installed, result sets of up to RANKED_CANDIDATES rows are ranked by the
+in-process BM25 index (bm25.py) instead of the backend's own scoring.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'products_product_fts'
+
+# Column weights: name, short_description, description
+SQLITE_WEIGHTS = (10.0, 4.0, 1.0)
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(products_product.name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(products_product.short_description, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(products_product.description, '')), 'C')"
+)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_ready = None
+
+
+def backend():
+    """Return 'sqlite', 'postgresql' or None for the active search backend"""
+    global _fts_ready
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        if _fts_ready is None:
+            _fts_ready = FTS_TABLE in connection.introspection.table_names()
+        return 'sqlite' if _fts_ready else None
+    return None
+
+
+def tokenize(query):
+    return [token.lower() for token in TOKEN_RE.findall(query or '')]
+
+
+def fts5_query(query):
+    # Quote every term so user input can't inject FTS5 syntax; the trailing *
+    # turns each term into a prefix match.
+    return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+
+# Result sets up to this size are ranked by the in-process BM25 index; larger
+# ones (broad queries) keep the database's own ranking
+RANKED_CANDIDATES = 500
+
+
+def search_products(queryset, query):
+    """
+    Filter a Product queryset down to matches for query, annotated with a
+    `search_rank` (higher is more relevant).
+    """
+    return rank_products(filter_products(queryset, query), query)
+
+
+def filter_products(queryset, query):
+    """Filter a Product queryset down to matches for query"""
+    if not tokenize(query):
+        return queryset.none()
+    engine = backend()
+    if engine == 'sqlite':
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (fts5_query(query),))
+        )
+    if engine == 'postgresql':
+        return queryset.annotate(
+            search_match=RawSQL(
+                f"({PG_DOCUMENT}) @@ websearch_to_tsquery('english', %s)",
+                (query,),
+                output_field=BooleanField(),
+            ),
+        ).filter(search_match=True)
+    return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
+
+
+def database_rank(query):
+    """The backend's own relevance expression for query"""
+    engine = backend()
+    if engine == 'sqlite':
+        weights = ', '.join(str(w) for w in SQLITE_WEIGHTS)
+        return RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = products_product.id',
+            (fts5_query(query),),
+            output_field=FloatField(),
+        )
+    if engine == 'postgresql':
+        return RawSQL(
+            f"ts_rank({PG_DOCUMENT}, websearch_to_tsquery('english', %s))",
+            (query,),
+            output_field=FloatField(),
+        )
+    return Value(0.0, output_field=FloatField())
+
+
+def rank_products(queryset, query):
+    """
+    Annotate matches from filter_products(), with any other filters (facets)
+    already applied, with `search_rank`. Only the rows of this queryset are
+    scored, and the scores are cached per catalog version so a cached
+    listing page still costs no queries.
+    """
+    from . import bm25
+    from .cache import cached
+
+    if not bm25.available() or queryset.query.is_empty():
+        return queryset.annotate(search_rank=database_rank(query))
+
+    def score():
+        ids = list(queryset.order_by().values_list('id', flat=True)[:RANKED_CANDIDATES + 1])
+        return bm25.index.scores(query, ids) if len(ids) <= RANKED_CANDIDATES else False
+
+    scores = cached('search_rank', {'q': query, 'sql': str(queryset.order_by().query)}, score)
+    if scores is False:
+        return queryset.annotate(search_rank=database_rank(query))
+    # Rows missing from the index (not yet seen by this process) score 0;
+    # views break rank ties on the primary key
+    return queryset.annotate(search_rank=Case(
+        *[When(id=product_id, then=Value(score)) for product_id, score in scores.items()],
+        default=Value(0.0),
+        output_field=FloatField(),
+    ))
+
+
+def index_product(product):
+    if backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, name, short_description, description) VALUES (%s, %s, %s, %s)',
+            [product.pk, product.name, product.short_description, product.description],
+        )
+
+
+def unindex_product(product_id):
+    if backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_index():
+    """Repopulate the FTS5 table from products_product. Returns rows indexed."""
+    if backend() != 'sqlite':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE}(rowid, name, short_description, description) '
+            f'SELECT id, name, short_description, description FROM products_product'
+        )
+        return cursor.rowcount
@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import bm25, ratings, renditions, search
+from .cache import bump_on_commit
+from .suggest import index as suggest_index
+from .models import Category, Product, ProductImage, Review
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+def queue_renditions(sender, instance, **kwargs):
+    renditions.enqueue_on_commit(instance.image)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.unindex_product(instance.pk)
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    ratings.review_saved(instance, created)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    ratings.review_deleted(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_on_commit()
+
+
+@receiver(post_save, sender=Product)
+def update_product_suggestions(sender, instance, **kwargs):
+    transaction.on_commit(lambda: suggest_index.update_product(instance))
+
+
+@receiver(post_save, sender=Product)
+def update_relevance_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bm25.index.update_product(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_relevance_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: bm25.index.remove_product(pk))
+
+
+@receiver(post_save, sender=Category)
+def update_category_suggestions(sender, instance, **kwargs):
+    transaction.on_commit(lambda: suggest_index.update_category(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_suggestions(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: suggest_index.remove('product', pk))
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_suggestions(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: suggest_index.remove('category', pk))
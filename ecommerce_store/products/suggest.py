@@ -0,0 +1,131 @@
+"""
+In-process prefix index for search-as-you-type.
+
+Product names (from every word position), SKUs and category names are kept
+in one sorted list of (key, kind, id) tuples; a lookup is a bisect to the
+first key >= prefix followed by a short forward scan, with no SQL.
+
+The index is an immutable Snapshot behind a single reference, so lookups
+never take a lock: the post-commit save/delete signals of this process swap
+in a patched copy, and live_index.LiveIndex rebuilds it in the background
+every REFRESH_SECONDS to pick up writes made by other processes.
+"""
+import bisect
+
+from django.urls import reverse
+
+from .live_index import LiveIndex
+from .models import Category, Product
+from .search import tokenize
+
+REFRESH_SECONDS = 300
+DEFAULT_LIMIT = 8
+
+
+def index_keys(text):
+    """'Red Running Shoe' -> ['red running shoe', 'running shoe', 'shoe']"""
+    tokens = tokenize(text)
+    return [' '.join(tokens[i:]) for i in range(len(tokens))]
+
+
+def product_keys(name, sku):
+    keys = index_keys(name)
+    sku_key = ' '.join(tokenize(sku))
+    if sku_key:
+        keys.append(sku_key)
+    return keys
+
+
+class Snapshot:
+    """Sorted entries plus payloads; never modified once published"""
+
+    def __init__(self, entries=(), payloads=None, keys_by_item=None):
+        self.entries = list(entries)
+        self.payloads = payloads or {}
+        self.keys_by_item = keys_by_item or {}
+
+    @classmethod
+    def load(cls):
+        entries, payloads, keys_by_item = [], {}, {}
+        products = Product.objects.filter(is_active=True).values_list('id', 'name', 'slug', 'sku')
+        for product_id, name, slug, sku in products.iterator(chunk_size=5000):
+            item = ('product', product_id)
+            keys = product_keys(name, sku)
+            payloads[item] = {'label': name, 'slug': slug, 'sku': sku}
+            keys_by_item[item] = keys
+            entries.extend((key, *item) for key in keys)
+        for category_id, name, slug in Category.objects.filter(is_active=True).values_list('id', 'name', 'slug'):
+            item = ('category', category_id)
+            keys = index_keys(name)
+            payloads[item] = {'label': name, 'slug': slug}
+            keys_by_item[item] = keys
+            entries.extend((key, *item) for key in keys)
+        entries.sort()
+        return cls(entries, payloads, keys_by_item)
+
+    def replace(self, item, keys, payload):
+        """A copy with item's entries replaced (payload None removes it)"""
+        entries, payloads, keys_by_item = list(self.entries), dict(self.payloads), dict(self.keys_by_item)
+        for key in keys_by_item.pop(item, []):
+            position = bisect.bisect_left(entries, (key, *item))
+            if position < len(entries) and entries[position] == (key, *item):
+                del entries[position]
+        payloads.pop(item, None)
+        if payload is not None:
+            keys_by_item[item] = keys
+            payloads[item] = payload
+            for key in keys:
+                bisect.insort(entries, (key, *item))
+        return Snapshot(entries, payloads, keys_by_item)
+
+
+class SuggestIndex(LiveIndex):
+    """The state is an immutable Snapshot, so lookups read it without the lock"""
+
+    REFRESH_SECONDS = REFRESH_SECONDS
+
+    def load(self):
+        return Snapshot.load()
+
+    def apply(self, snapshot, change):
+        return snapshot.replace(*change)
+
+    def update_product(self, product):
+        payload = {'label': product.name, 'slug': product.slug, 'sku': product.sku} if product.is_active else None
+        self.change((('product', product.pk), product_keys(product.name, product.sku), payload))
+
+    def update_category(self, category):
+        payload = {'label': category.name, 'slug': category.slug} if category.is_active else None
+        self.change((('category', category.pk), index_keys(category.name), payload))
+
+    def remove(self, kind, pk):
+        self.change(((kind, pk), [], None))
+
+    def lookup(self, query, limit=DEFAULT_LIMIT):
+        prefix = ' '.join(tokenize(query))
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        snapshot = self.state
+        entries, payloads = snapshot.entries, snapshot.payloads
+        results, seen = [], set()
+        position = bisect.bisect_left(entries, (prefix,))
+        while position < len(entries) and len(results) < limit:
+            key, kind, pk = entries[position]
+            if not key.startswith(prefix):
+                break
+            position += 1
+            if (kind, pk) in seen or (kind, pk) not in payloads:
+                continue
+            seen.add((kind, pk))
+            payload = payloads[(kind, pk)]
+            if kind == 'product':
+                url = reverse('products:product_detail', args=[payload['slug']])
+                results.append({'type': kind, 'label': payload['label'], 'sku': payload['sku'], 'url': url})
+            else:
+                url = reverse('products:category_products', args=[payload['slug']])
+                results.append({'type': kind, 'label': payload['label'], 'url': url})
+        return results
+
+
+index = SuggestIndex()
@@ -0,0 +1,23 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from products.renditions import RENDITION_SPECS, ready_renditions
+
+register = template.Library()
+
+
+@register.filter
+def rendition(image, spec):
+    """
+    URL of the `spec` rendition of an ImageField value. Falls back to the
+    original upload until the worker has produced it; WebP specs fall back to
+    '' so they can be used as an optional <source srcset>.
+    """
+    if not image:
+        return ''
+    name = ready_renditions(image.name).get(spec)
+    if name:
+        return default_storage.url(name)
+    if RENDITION_SPECS.get(spec, (None, None, 'JPEG'))[2] == 'WEBP':
+        return ''
+    return image.url
@@ -0,0 +1,47 @@
+"""
+Shared test helpers for the catalog and the apps built on it (cart, orders).
+
+Catalog test cases run with TEST_CACHES, so they never read or bump the
+on-disk catalog cache of the dev server, and start every test with an empty
+catalog cache.
+"""
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from .models import Category, Product
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'catalog': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-catalog'},
+}
+
+
+class CatalogCacheMixin:
+
+    def setUp(self):
+        super().setUp()
+        caches['catalog'].clear()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CatalogTestCase(CatalogCacheMixin, TestCase):
+    pass
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CatalogTransactionTestCase(CatalogCacheMixin, TransactionTestCase):
+    pass
+
+
+def make_product(name, sku, category=None, **fields):
+    """An active product priced 100.00, in a 'Shoes' category unless given one"""
+    if category is None:
+        category = Category.objects.get_or_create(slug='shoes', defaults={'name': 'Shoes'})[0]
+    fields.setdefault('price', Decimal('100.00'))
+    return Product.objects.create(
+        name=name, slug=fields.pop('slug', sku.lower()), sku=sku, category=category,
+        description=fields.pop('description', name), short_description=fields.pop('short_description', name),
+        **fields,
+    )
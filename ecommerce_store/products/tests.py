@@ -1,3 +1,713 @@
-from django.test import TestCase
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import QueryDict
+from django.test import override_settings
+from django.utils.http import http_date
+
+from orders.models import Order, OrderItem
+
+from . import bm25, renditions
+from .cache import cached, catalog_version
+from .facets import FacetSelection, apply_facets, facet_counts
+from .models import Category, ImageRendition, Product, ProductNeighbor, Review
+from .pagination import CursorPaginator
+from .ratings import rebuild_ratings
+from .search import search_products
+from .suggest import Snapshot, index as suggest_index
+from .testing import TEST_CACHES, CatalogTestCase, make_product
+from .views import SORT_ORDERINGS, get_related_products
+
+
+class SearchTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.runner = make_product('Trail Runner', 'RUN-1', description='Grippy sole for muddy trails', category=cls.shoes)
+        cls.boot = make_product('Hiking Boot', 'BOOT-1', description='Waterproof leather', category=cls.shoes)
+        cls.hidden = make_product('Trail Sandal', 'SAN-1', is_active=False, category=cls.shoes)
+
+    def setUp(self):
+        super().setUp()
+
+    def search(self, query):
+        return set(search_products(Product.objects.filter(is_active=True), query))
+
+    def test_matches_name_and_description(self):
+        self.assertEqual(self.search('trail'), {self.runner})
+        self.assertEqual(self.search('waterproof'), {self.boot})
+
+    def test_terms_match_as_prefixes(self):
+        self.assertEqual(self.search('hik'), {self.boot})
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search('trail leather'), set())
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('"trail" OR boot*'), set())
+        self.assertEqual(self.search('!!!'), set())
+
+    def test_index_follows_edits(self):
+        self.boot.name = 'Mountain Boot'
+        self.boot.save()
+        self.assertEqual(self.search('mountain'), {self.boot})
+        self.boot.delete()
+        self.assertEqual(self.search('waterproof'), set())
+
+    def test_product_list_search(self):
+        response = self.client.get('/products/', {'q': 'trail'})
+        self.assertEqual(list(response.context['page_obj']), [self.runner])
+
+    def test_product_list_search_without_terms_is_an_empty_page(self):
+        for query in ('!!', '"'):
+            with self.subTest(query):
+                response = self.client.get('/products/', {'q': query})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(list(response.context['page_obj']), [])
+                self.assertEqual(response.context['page_obj'].paginator.count, 0)
+
+
+class CursorPaginationTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        for i in range(7):
+            make_product(f'Trail Shoe {i}', f'SKU-{i}', price=Decimal(100 + i % 2), category=shoes)
+        # Every product shares a created_at, so only the id breaks ties
+        Product.objects.update(created_at=Product.objects.first().created_at)
+
+    def walk(self, queryset, ordering, per_page=3):
+        paginator = CursorPaginator(queryset, per_page, ordering)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginator.get_page(backwards[-1].previous_cursor))
+        return [list(page) for page in pages], [list(page) for page in reversed(backwards)]
+
+    def assertWalksEveryRowOnce(self, queryset, ordering):
+        forward, backward = self.walk(queryset, ordering)
+        rows = [product for page in forward for product in page]
+        self.assertEqual(rows, list(queryset.order_by(*ordering)))
+        self.assertEqual(len(set(rows)), queryset.count())
+        self.assertEqual(backward, forward)
+
+    def test_every_sort_order_pages_through_ties(self):
+        products = Product.objects.filter(is_active=True)
+        for sort_by in ('newest', 'price_low', 'price_high', 'name'):
+            with self.subTest(sort_by):
+                self.assertWalksEveryRowOnce(products, SORT_ORDERINGS[sort_by])
+
+    def test_relevance_ties_are_broken_by_newest_id(self):
+        results = search_products(Product.objects.filter(is_active=True), 'trail shoe')
+        ordering = SORT_ORDERINGS['relevance']
+        self.assertEqual(ordering[-1], '-id')
+        self.assertWalksEveryRowOnce(results, ordering)
+
+    def test_malformed_cursor_starts_over(self):
+        paginator = CursorPaginator(Product.objects.all(), 3, SORT_ORDERINGS['newest'])
+        self.assertEqual(list(paginator.get_page('not-a-cursor')), list(paginator.get_page()))
+
+
+class RatingAggregateTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.product = make_product('Runner', 'RUN-1', category=shoes)
+        cls.other = make_product('Boot', 'BOOT-1', category=shoes)
+        cls.users = [User.objects.create_user(f'reviewer{i}') for i in range(3)]
+
+    def aggregates(self, product):
+        product.refresh_from_db()
+        return product.review_count, product.rating_sum, product.avg_rating
+
+    def test_create_edit_and_delete_keep_aggregates_current(self):
+        first = Review.objects.create(product=self.product, user=self.users[0], rating=5, comment='Great')
+        Review.objects.create(product=self.product, user=self.users[1], rating=2, comment='Meh')
+        self.assertEqual(self.aggregates(self.product), (2, 7, 3.5))
+
+        first = Review.objects.get(pk=first.pk)
+        first.rating = 3
+        first.save()
+        self.assertEqual(self.aggregates(self.product), (2, 5, 2.5))
+
+        first.product = self.other
+        first.save()
+        self.assertEqual(self.aggregates(self.product), (1, 2, 2.0))
+        self.assertEqual(self.aggregates(self.other), (1, 3, 3.0))
+
+        first.delete()
+        self.assertEqual(self.aggregates(self.other), (0, 0, None))
+
+    def test_product_save_does_not_overwrite_aggregates(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=self.users[0], rating=4, comment='Good')
+        stale.name = 'Road Runner'
+        stale.save()
+        self.assertEqual(self.aggregates(self.product), (1, 4, 4.0))
+
+    def test_rebuild_matches_incremental_updates(self):
+        for user, rating in zip(self.users, (1, 4, 5)):
+            Review.objects.create(product=self.product, user=user, rating=rating, comment='...')
+        expected = self.aggregates(self.product)
+        Product.objects.update(rating_sum=0, review_count=0, avg_rating=None)
+        self.assertEqual(rebuild_ratings(), 2)
+        self.assertEqual(self.aggregates(self.product), expected)
+        self.assertEqual(self.aggregates(self.other), (0, 0, None))
+
+
+def read_in_other_process(location, key):
+    """Read a file-based cache entry from a fresh interpreter, as a web worker would"""
+    script = (
+        'import json, sys\n'
+        'from django.core.cache.backends.filebased import FileBasedCache\n'
+        'print(json.dumps(FileBasedCache(sys.argv[1], {}).get(sys.argv[2], "<missing>")))\n'
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', script, str(location), key], capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output)
+
+
+class RenditionTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(self.cache_dir.cleanup)
+        settings = override_settings(
+            MEDIA_ROOT=media.name,
+            CACHES=dict(TEST_CACHES, catalog={
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.cache_dir.name,
+            }),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 900), 'red').save(buffer, 'PNG')
+        self.source = default_storage.save('products/shoe.png', ContentFile(buffer.getvalue()))
+
+    def test_worker_output_reaches_other_processes(self):
+        key = renditions.cache_key(self.source)
+        # A web process renders the page before the worker has run
+        self.assertEqual(renditions.ready_renditions(self.source), {})
+        self.assertEqual(read_in_other_process(self.cache_dir.name, key), {})
+
+        renditions.enqueue(self.source)
+        self.assertEqual(renditions.process(renditions.claim_batch(50)), len(renditions.RENDITION_SPECS))
+
+        # The worker's invalidation is visible to every process sharing the cache
+        self.assertEqual(read_in_other_process(self.cache_dir.name, key), '<missing>')
+        ready = renditions.ready_renditions(self.source)
+        self.assertEqual(set(ready), set(renditions.RENDITION_SPECS))
+        self.assertEqual(read_in_other_process(self.cache_dir.name, key), ready)
+
+        card = ImageRendition.objects.get(source=self.source, spec='card')
+        self.assertEqual((card.width, card.height), (400, 300))
+        self.assertTrue(default_storage.exists(card.file))
+
+    def test_unreadable_source_is_marked_failed(self):
+        renditions.enqueue('products/missing.png')
+        with self.assertLogs('products.renditions', 'ERROR'):
+            self.assertEqual(renditions.process(renditions.claim_batch(50)), 0)
+        self.assertEqual(
+            set(ImageRendition.objects.filter(source='products/missing.png').values_list('status', flat=True)),
+            {'failed'},
+        )
+
+    def test_failed_renditions_are_retried_when_the_image_is_saved_again(self):
+        product = make_product('Runner', 'RUN-1')
+        product.image = 'products/replaced.png'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        with self.assertLogs('products.renditions', 'ERROR'):
+            renditions.process(renditions.claim_batch(50))
+        self.assertFalse(ImageRendition.objects.exclude(status='failed').exists())
+
+        # The upload is fixed and the product saved again
+        with default_storage.open(self.source) as fh:
+            default_storage.save('products/replaced.png', fh)
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(renditions.process(renditions.claim_batch(50)), len(renditions.RENDITION_SPECS))
+        self.assertEqual(set(renditions.ready_renditions('products/replaced.png')), set(renditions.RENDITION_SPECS))
+
+
+class CatalogCacheTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.product = make_product('Runner', 'RUN-1', price=Decimal('120.00'), category=cls.shoes)
+
+    def setUp(self):
+        super().setUp()
+
+    def test_cached_builds_once_per_version(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(cached('view', {'a': 1}, build), 1)
+        self.assertEqual(cached('view', {'a': 1}, build), 1)
+        self.assertEqual(cached('view', {'a': 2}, build), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(cached('view', {'a': 1}, build), 3)
+
+    def test_version_moves_only_when_the_change_commits(self):
+        version = catalog_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.shoes.save()
+        self.assertEqual(catalog_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(catalog_version(), version)
+
+    def test_listing_is_served_from_cache_until_catalog_changes(self):
+        self.assertEqual(self.client.get('/products/').context['page_obj'].object_list[0].price, Decimal('120.00'))
+        with self.assertNumQueries(0):
+            # Categories, facet counts and the page all come from the cache
+            self.client.get('/products/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('99.00')
+            self.product.save()
+        self.assertEqual(self.client.get('/products/').context['page_obj'].object_list[0].price, Decimal('99.00'))
+
+
+class FacetTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.bags = Category.objects.create(name='Bags', slug='bags')
+        cls.cheap_shoe = make_product('Flip Flop', 'S-1', price=Decimal('300'), category=cls.shoes)
+        cls.sale_shoe = make_product('Runner', 'S-2', price=Decimal('2000'), discount_price=Decimal('800'), category=cls.shoes)
+        cls.boot = make_product('Boot', 'S-3', price=Decimal('6000'), stock_status='out_of_stock', category=cls.shoes)
+        cls.bag = make_product('Tote', 'B-1', price=Decimal('700'), is_featured=True, category=cls.bags)
+        cls.categories = [cls.bags, cls.shoes]
+
+    def setUp(self):
+        super().setUp()
+
+    def select(self, query):
+        return FacetSelection(QueryDict(query), self.categories)
+
+    def counts(self, selection):
+        counts = facet_counts(Product.objects.filter(is_active=True), selection, self.categories)
+        flat = {f"category:{row['value']}": row['count'] for row in counts['category']}
+        flat.update({f"price:{row['value']}": row['count'] for row in counts['price']})
+        flat.update({f"stock:{row['value']}": row['count'] for row in counts['stock']})
+        flat.update(on_sale=counts['on_sale']['count'], featured=counts['featured']['count'])
+        return flat
+
+    def test_counts_without_selection(self):
+        with self.assertNumQueries(1):
+            counts = self.counts(self.select(''))
+        self.assertEqual(counts['category:shoes'], 3)
+        self.assertEqual(counts['category:bags'], 1)
+        # The sale price decides the bucket
+        self.assertEqual(counts['price:500-1000'], 2)
+        self.assertEqual(counts['price:5000-plus'], 1)
+        self.assertEqual(counts['stock:out_of_stock'], 1)
+        self.assertEqual((counts['on_sale'], counts['featured']), (1, 1))
+
+    def test_each_facet_is_counted_under_the_other_selections(self):
+        selection = self.select('category=shoes&price=500-1000')
+        counts = self.counts(selection)
+        # Sibling categories are counted within the selected price bucket...
+        self.assertEqual((counts['category:shoes'], counts['category:bags']), (1, 1))
+        # ...and sibling price buckets within the selected category
+        self.assertEqual((counts['price:under-500'], counts['price:5000-plus']), (1, 1))
+        self.assertEqual(
+            list(apply_facets(Product.objects.filter(is_active=True), selection)), [self.sale_shoe],
+        )
+
+    def test_values_within_a_facet_are_ored(self):
+        selection = self.select('price=under-500&price=5000-plus&stock=in_stock')
+        self.assertEqual(list(apply_facets(Product.objects.all(), selection)), [self.cheap_shoe])
+
+    def test_product_list_filters_and_rejects_unknown_categories(self):
+        response = self.client.get('/products/', {'category': 'bags', 'featured': '1'})
+        self.assertEqual(list(response.context['page_obj']), [self.bag])
+        self.assertEqual(self.client.get('/products/', {'category': 'hats'}).status_code, 404)
+
+
+class RelatedProductsTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        bags = Category.objects.create(name='Bags', slug='bags')
+        cls.runner = make_product('Runner', 'S-1', category=shoes)
+        cls.socks = make_product('Socks', 'S-2', category=shoes)
+        cls.insoles = make_product('Insoles', 'S-3', category=shoes)
+        cls.boot = make_product('Boot', 'S-4', category=shoes)
+        cls.tote = make_product('Tote', 'B-1', category=bags)
+        cls.user = User.objects.create_user('shopper')
+
+    def order(self, *products):
+        order = Order.objects.create(
+            user=self.user, first_name='A', last_name='B', email='a@example.com', phone='1',
+            address_line_1='1 Road', city='Town', state='State', postal_code='1', country='IN',
+            subtotal=0, total_amount=0,
+        )
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product=product, quantity=1, price=1, total=1) for product in products]
+        )
+
+    def test_neighbours_are_ranked_by_co_purchases(self):
+        self.order(self.runner, self.socks, self.tote)
+        self.order(self.runner, self.socks)
+        self.order(self.runner, self.insoles)
+        call_command('build_related_products', '--top', '2', stdout=io.StringIO())
+
+        self.assertEqual(
+            list(ProductNeighbor.objects.filter(product=self.runner).values_list('neighbor', 'score', 'rank')),
+            [(self.socks.pk, 2, 1), (self.insoles.pk, 1, 2)],
+        )
+        self.assertEqual(ProductNeighbor.objects.filter(product=self.socks).count(), 2)
+        # Rebuilding replaces the table rather than adding to it
+        call_command('build_related_products', '--top', '2', stdout=io.StringIO())
+        self.assertEqual(ProductNeighbor.objects.filter(product=self.runner).count(), 2)
+
+    def test_related_products_are_topped_up_from_the_category(self):
+        self.order(self.tote, self.boot)
+        call_command('build_related_products', stdout=io.StringIO())
+        related = get_related_products(self.tote)
+        self.assertEqual(related, [self.boot])
+
+        related = get_related_products(self.boot)
+        self.assertEqual(related[0], self.tote)
+        self.assertEqual(set(related[1:]), {self.runner, self.socks, self.insoles})
+
+
+class ImportProductsTests(CatalogTestCase):
+
+    def run_import(self, text, suffix):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as fh:
+            fh.write(text)
+        self.addCleanup(os.unlink, fh.name)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_products', fh.name, '--batch-size', '2', stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_import_creates_then_updates(self):
+        csv_text = (
+            'sku,name,category,category_name,price,discount_price,stock_quantity,is_featured\n'
+            'S-1,Trail Runner,shoes,Shoes,120.00,99.00,5,yes\n'
+            'S-2,Boot,shoes,Shoes,200,,0,\n'
+            'B-1,Tote,bags,,50,,3,no\n'
+        )
+        stdout, stderr = self.run_import(csv_text, '.csv')
+        self.assertIn('3 created, 0 updated, 0 failed', stdout)
+        self.assertEqual(stderr, '')
+        runner = Product.objects.get(sku='S-1')
+        self.assertEqual((runner.category.slug, runner.effective_price, runner.is_featured),
+                         ('shoes', Decimal('99.00'), True))
+        self.assertEqual(Category.objects.get(slug='bags').name, 'Bags')
+        self.assertEqual(search_products(Product.objects.all(), 'trail').get(), runner)
+
+        stdout, _ = self.run_import('sku,name,category,price\nS-1,Trail Runner 2,shoes,130\n', '.csv')
+        self.assertIn('0 created, 1 updated', stdout)
+        self.assertEqual(Product.objects.get(sku='S-1').name, 'Trail Runner 2')
+
+    def test_bad_rows_are_reported_per_line(self):
+        Category.objects.create(name='Shoes', slug='footwear')
+        make_product('Tote', 'B-1', slug='tote', category=Category.objects.create(name='Bags', slug='bags'))
+        lines = [
+            {'sku': 'S-1', 'name': 'Runner', 'category': 'footwear', 'price': '10'},
+            ['not', 'an', 'object'],
+            {'sku': 'S-2', 'name': 'Boot', 'category': 'footwear', 'price': '10', 'stock_status': 'lost'},
+            # The slug is new but the name belongs to 'footwear'
+            {'sku': 'S-3', 'name': 'Sandal', 'category': 'shoes', 'category_name': 'Shoes', 'price': '10'},
+            {'sku': 'S-4', 'name': 'Tote copy', 'slug': 'tote', 'category': 'bags', 'price': '10'},
+            {'sku': 'S-5', 'name': 'Clog', 'category': 'footwear', 'price': 'NaN'},
+            {'sku': 'S-6', 'name': 'Slipper', 'category': 'footwear', 'price': '12'},
+        ]
+        text = '\n'.join(json.dumps(line) for line in lines) + '\n{broken\n'
+        stdout, stderr = self.run_import(text, '.jsonl')
+
+        self.assertIn('2 created, 0 updated, 6 failed', stdout)
+        failed_lines = sorted(int(line.split(':')[0].split()[1]) for line in stderr.splitlines())
+        self.assertEqual(failed_lines, [2, 3, 4, 5, 6, 8])
+        self.assertIn('expected a JSON object', stderr)
+        self.assertIn("invalid stock_status: 'lost'", stderr)
+        self.assertIn("slug 'tote' is already used by sku 'B-1'", stderr)
+        self.assertEqual(set(Product.objects.values_list('sku', flat=True)), {'B-1', 'S-1', 'S-6'})
+
+
+class EffectivePriceTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+
+    def setUp(self):
+        super().setUp()
+
+    def test_effective_price_follows_price_and_discount(self):
+        product = make_product('Runner', 'S-1', price=Decimal('100'), discount_price=Decimal('80'), category=self.shoes)
+        product.refresh_from_db()
+        self.assertEqual(product.effective_price, Decimal('80'))
+
+        # A "discount" above the price is ignored
+        product.discount_price = Decimal('150')
+        product.save()
+        self.assertEqual(product.effective_price, Decimal('100'))
+
+        product.discount_price = None
+        product.price = Decimal('90')
+        product.save()
+        self.assertEqual(product.effective_price, Decimal('90'))
+
+    def test_price_sort_uses_the_price_customers_pay(self):
+        sale = make_product('Sale', 'S-1', price=Decimal('500'), discount_price=Decimal('50'), category=self.shoes)
+        plain = make_product('Plain', 'S-2', price=Decimal('100'), category=self.shoes)
+        response = self.client.get('/products/', {'sort': 'price_low'})
+        self.assertEqual(list(response.context['page_obj']), [sale, plain])
+        response = self.client.get('/products/category/shoes/', {'sort': 'price_high'})
+        self.assertEqual(list(response.context['page_obj']), [plain, sale])
+
+
+class ConditionalGetTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = make_product('Runner', 'S-1')
+        cls.user = User.objects.create_user('shopper')
+
+    def setUp(self):
+        super().setUp()
+
+    def test_matching_etag_gets_304_until_the_product_changes(self):
+        url = self.product.get_absolute_url()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.product.price = Decimal('1.00')
+        self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_listing_changes_when_a_product_leaves_it(self):
+        other = make_product('Walker', 'S-2', category=self.product.category)
+        response = self.client.get('/products/')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        # A timestamp alone never validates the page
+        self.assertEqual(self.client.get('/products/', HTTP_IF_MODIFIED_SINCE=http_date()).status_code, 200)
+
+        other.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        # Deactivating moved no remaining row's updated_at; the ETag still changes
+        response = self.client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page_obj']), [self.product])
+
+    def test_etag_differs_per_visitor(self):
+        url = self.product.get_absolute_url()
+        anonymous = self.client.get(url)['ETag']
+        self.client.force_login(self.user)
+        self.assertNotEqual(self.client.get(url)['ETag'], anonymous)
+
+
+class SuggestTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Running Shoes', slug='running-shoes')
+        cls.runner = make_product('Red Trail Runner', 'TR-100', category=cls.shoes)
+
+    def setUp(self):
+        super().setUp()
+        suggest_index.build()
+
+    def labels(self, query):
+        return [(row['type'], row['label']) for row in suggest_index.lookup(query)]
+
+    def test_prefix_of_any_word_name_or_sku(self):
+        self.assertEqual(self.labels('trail ru'), [('product', 'Red Trail Runner')])
+        self.assertEqual(self.labels('tr 10'), [('product', 'Red Trail Runner')])
+        self.assertEqual(self.labels('runn'), [('product', 'Red Trail Runner'), ('category', 'Running Shoes')])
+        self.assertEqual(self.labels(''), [])
+
+    def test_saves_and_deletes_patch_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            boot = make_product('Hiking Boot', 'HB-1', category=self.shoes)
+        self.assertEqual(self.labels('hik'), [('product', 'Hiking Boot')])
+        with self.captureOnCommitCallbacks(execute=True):
+            boot.name = 'Winter Boot'
+            boot.save()
+        self.assertEqual(self.labels('hik'), [])
+        self.assertEqual(self.labels('winter'), [('product', 'Winter Boot')])
+        with self.captureOnCommitCallbacks(execute=True):
+            boot.delete()
+        self.assertEqual(self.labels('winter'), [])
+
+    def test_view(self):
+        response = self.client.get('/products/suggest/', {'q': 'red'})
+        self.assertEqual(response.json()['suggestions'][0]['url'], self.runner.get_absolute_url())
+
+    def test_first_build_runs_once_for_concurrent_requests(self):
+        fresh = type(suggest_index)()
+        loads, start = [], threading.Barrier(8)
+
+        def load():
+            loads.append(1)
+            time.sleep(0.05)
+            return Snapshot([('red trail runner', 'product', 1)], {('product', 1): {'label': 'x', 'slug': 'x', 'sku': 'x'}})
+
+        results = []
+        with mock.patch.object(Snapshot, 'load', side_effect=load):
+            threads = [threading.Thread(target=lambda: (start.wait(), results.append(fresh.lookup('red'))))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual([len(result) for result in results], [1] * 8)
+
+    def test_stale_index_rebuilds_in_the_background(self):
+        loading, release = threading.Event(), threading.Event()
+        new = Snapshot([('winter boot', 'product', 2)], {('product', 2): {'label': 'Winter Boot', 'slug': 'w', 'sku': 'w'}})
+
+        def load():
+            loading.set()
+            release.wait(5)
+            return new
+
+        suggest_index.built_at -= 2 * 300
+        with mock.patch.object(Snapshot, 'load', side_effect=load):
+            # Answered from the old snapshot while a single rebuild runs
+            self.assertEqual(self.labels('red'), [('product', 'Red Trail Runner')])
+            self.assertTrue(loading.wait(5))
+            self.assertEqual(self.labels('red'), [('product', 'Red Trail Runner')])
+            # A change made during the rebuild survives the swap
+            suggest_index.update_product(self.runner)
+            release.set()
+            with suggest_index.build_lock:
+                pass
+        self.assertEqual(self.labels('winter'), [('product', 'Winter Boot')])
+        self.assertEqual(self.labels('red'), [('product', 'Red Trail Runner')])
+
+    def test_lookups_during_updates_see_whole_snapshots(self):
+        stop, errors = threading.Event(), []
+
+        def read():
+            while not stop.is_set():
+                try:
+                    labels = self.labels('red')
+                    assert labels in ([], [('product', 'Red Trail Runner')]), labels
+                except Exception as exc:
+                    errors.append(exc)
+                    return
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for i in range(300):
+            if i % 2:
+                suggest_index.remove('product', self.runner.pk)
+            else:
+                suggest_index.update_product(self.runner)
+        stop.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+
+
+class RelevanceTests(CatalogTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        bags = Category.objects.create(name='Bags', slug='bags')
+        # Strong matches that would fill any global top-N
+        for i in range(6):
+            make_product(f'Leather Leather Boot {i}', f'S-{i}', description='Leather leather leather', category=shoes)
+        cls.tote = make_product('Leather Tote', 'B-1', description='Roomy tote', category=bags)
+        cls.satchel = make_product('Canvas Satchel', 'B-2', description='Canvas with a leather strap', category=bags)
+
+    def setUp(self):
+        super().setUp()
+        bm25.index.build()
+
+    def listed(self, **params):
+        response = self.client.get('/products/', params)
+        return [(product, product.search_rank) for product in response.context['page_obj']]
+
+    def test_facet_filtered_matches_are_scored(self):
+        with mock.patch('products.search.RANKED_CANDIDATES', 3):
+            listed = self.listed(q='leather', category='bags')
+        self.assertEqual([product for product, _ in listed], [self.tote, self.satchel])
+        self.assertTrue(all(rank > 0 for _, rank in listed))
+
+    def test_large_result_sets_use_the_database_rank(self):
+        with mock.patch('products.search.RANKED_CANDIDATES', 3):
+            listed = self.listed(q='leather')
+        self.assertEqual(len(listed), 8)
+        self.assertTrue(all(rank > 0 for _, rank in listed))
+        self.assertEqual(listed[-1][0], self.satchel)
+
+    def test_index_follows_product_changes(self):
+        before = bm25.index.scores('leather', [self.satchel.pk])[self.satchel.pk]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.satchel.name = 'Leather Satchel'
+            self.satchel.save()
+        self.assertGreater(bm25.index.scores('leather', [self.satchel.pk])[self.satchel.pk], before)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.satchel.delete()
+        self.assertNotIn(self.satchel.pk, bm25.index.scores('leather', [self.satchel.pk]))
+
+    def test_rebuild_does_not_block_scoring(self):
+        loading, release = threading.Event(), threading.Event()
+        fresh = bm25.Postings.load()
+
+        def slow_load():
+            loading.set()
+            release.wait(5)
+            return fresh
+
+        with mock.patch.object(bm25.Postings, 'load', side_effect=slow_load):
+            rebuild = threading.Thread(target=bm25.index.build)
+            rebuild.start()
+            try:
+                self.assertTrue(loading.wait(5))
+                started = time.monotonic()
+                scores = bm25.index.scores('tote', [self.tote.pk])
+                self.assertLess(time.monotonic() - started, 1)
+                self.assertGreater(scores[self.tote.pk], 0)
+            finally:
+                release.set()
+                rebuild.join()
@@ -5,6 +5,7 @@ app_name = 'products'
 
 urlpatterns = [
     path('', views.product_list, name='product_list'),
+    path('suggest/', views.suggest, name='suggest'),
     path('<slug:slug>/', views.product_detail, name='product_detail'),
     path('category/<slug:slug>/', views.category_products, name='category_products'),
 ]
\ No newline at end of file
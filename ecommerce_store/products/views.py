@@ -1,59 +1,119 @@
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import get_object_or_404
 from django.core.paginator import Paginator
-from django.db.models import Q, Avg
-from .models import Product, Category, Review
+from django.http import Http404, JsonResponse
+from django.utils.http import urlencode
+from orders.reservations import with_available
+from .cache import cached, cached_page
+from .conditional import conditional_render
+from .facets import FACET_PARAMS, FacetSelection, apply_facets, facet_counts
+from .models import Product, Category
+from .pagination import CursorPaginator
+from .search import filter_products, rank_products
+from .suggest import index as suggest_index
+
+PRODUCTS_PER_PAGE = 12
+
+# Keyset orderings for each sort option; every one ends in the primary key so
+# cursors are unambiguous. Relevance ties are common (equal scores), so the
+# newest of them comes first, as before keyset pagination.
+SORT_ORDERINGS = {
+    'newest': ('-created_at', 'id'),
+    'price_low': ('effective_price', 'id'),
+    'price_high': ('-effective_price', 'id'),
+    'name': ('name', 'id'),
+    'relevance': ('-search_rank', '-id'),
+}
+
+def active_categories():
+    return cached('categories', {}, lambda: list(Category.objects.filter(is_active=True)))
+
+def get_active_category(slug):
+    for category in active_categories():
+        if category.slug == slug:
+            return category
+    raise Http404('No Category matches the given query.')
+
+def paginate_products(request, products, sort_by, view, params):
+    ordering = SORT_ORDERINGS.get(sort_by, SORT_ORDERINGS['newest'])
+    # Legacy ?page=N links keep working through the offset paginator
+    page_number = request.GET.get('page')
+    if page_number:
+        return Paginator(products.order_by(*ordering), PRODUCTS_PER_PAGE).get_page(page_number)
+    paginator = CursorPaginator(products, PRODUCTS_PER_PAGE, ordering)
+    return cached_page(paginator, request.GET.get('cursor'), view, dict(params, sort=sort_by))
 
 def product_list(request):
     products = Product.objects.filter(is_active=True)
-    categories = Category.objects.filter(is_active=True)
+    categories = active_categories()
+    category = None
     
     # Search functionality
     query = request.GET.get('q')
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query)
-        )
+        products = filter_products(products, query)
     
-    # Category filter
-    category_slug = request.GET.get('category')
-    if category_slug:
-        category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=category)
+    # Facet filters (category, price, stock, on sale, featured)
+    selection = FacetSelection(request.GET, categories)
+    if selection.unknown_categories:
+        raise Http404('No Category matches the given query.')
+    facet_params = selection.as_params()
+    facets = cached('facets', dict(facet_params, q=query),
+                    lambda: facet_counts(products, selection, categories))
+    products = apply_facets(products, selection)
+    if query:
+        # Ranked after the facets so exactly the rows being listed are scored
+        products = rank_products(products, query)
+    if len(selection.categories) == 1:
+        category = selection.categories[0]
+    category_slug = category.slug if category else None
     
-    # Sorting
-    sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    else:
-        products = products.order_by('-created_at')
+    # Sorting (search results default to relevance)
+    sort_by = request.GET.get('sort', 'relevance' if query else 'newest')
+    if sort_by not in SORT_ORDERINGS or (sort_by == 'relevance' and not query):
+        sort_by = 'newest'
     
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate_products(request, products, sort_by, 'product_list', dict(facet_params, q=query))
+    
+    # Query string carrying search + facets + sort, for pagination links
+    filter_params = {key: request.GET.getlist(key) for key in FACET_PARAMS if key in request.GET}
+    if query:
+        filter_params['q'] = query
+    filter_params['sort'] = sort_by
     
     context = {
         'page_obj': page_obj,
         'categories': categories,
+        'category': category,
+        'facets': facets,
+        'filter_query': urlencode(filter_params, doseq=True),
         'query': query,
         'sort_by': sort_by,
         'category_slug': category_slug,
     }
-    return render(request, 'products/product_list.html', context)
+    return conditional_render(request, 'products/product_list.html', context, page_obj)
+
+RELATED_PRODUCTS_LIMIT = 4
+
+def get_related_products(product, limit=RELATED_PRODUCTS_LIMIT):
+    # Co-purchase neighbours (one lookup on the (product, rank) index), topped
+    # up from the same category when there isn't enough order history
+    related = list(
+        Product.objects.filter(neighbor_of__product=product, is_active=True)
+        .order_by('neighbor_of__rank')[:limit]
+    )
+    if len(related) < limit:
+        related += Product.objects.filter(
+            category_id=product.category_id,
+            is_active=True
+        ).exclude(id__in=[product.id] + [p.id for p in related])[:limit - len(related)]
+    return related
 
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    reviews = product.reviews.all()
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-    related_products = Product.objects.filter(
-        category=product.category, 
-        is_active=True
-    ).exclude(id=product.id)[:4]
+    product = get_object_or_404(with_available(Product.objects.all()), slug=slug, is_active=True)
+    reviews = product.reviews.select_related('user')
+    avg_rating = product.avg_rating
+    related_products = get_related_products(product)
     
     context = {
         'product': product,
@@ -61,31 +121,33 @@ def product_detail(request, slug):
         'avg_rating': avg_rating,
         'related_products': related_products,
     }
-    return render(request, 'products/product_detail.html', context)
+    return conditional_render(request, 'products/product_detail.html', context, [product])
 
 def category_products(request, slug):
-    category = get_object_or_404(Category, slug=slug, is_active=True)
+    category = get_active_category(slug)
     products = Product.objects.filter(category=category, is_active=True)
     
     # Sorting
     sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    else:
-        products = products.order_by('-created_at')
+    if sort_by not in SORT_ORDERINGS or sort_by == 'relevance':
+        sort_by = 'newest'
     
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate_products(request, products, sort_by, 'category_products', {
+        'category': slug,
+    })
     
     context = {
         'category': category,
         'page_obj': page_obj,
         'sort_by': sort_by,
     }
-    return render(request, 'products/category_products.html', context)
\ No newline at end of file
+    return conditional_render(request, 'products/category_products.html', context, page_obj)
+
+def suggest(request):
+    """Typeahead suggestions served from the in-process prefix index"""
+    query = request.GET.get('q', '')[:100]
+    return JsonResponse({
+        'query': query,
+        'suggestions': suggest_index.lookup(query),
+    })
\ No newline at end of file
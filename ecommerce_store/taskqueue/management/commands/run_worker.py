@@ -0,0 +1,61 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from taskqueue import queue
+
+logger = logging.getLogger(__name__)
+
+
+def run_task(task_row):
+    try:
+        return queue.run(task_row)
+    except Exception:
+        # Recording the outcome failed (e.g. the database went away); the
+        # claim goes stale and another pass retries the task, and the
+        # worker loop carries on
+        logger.exception(f'Task {task_row.name} #{task_row.id} could not be run')
+        return False
+    finally:
+        # Each pool thread holds its own connection; don't let it go stale
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (order emails, stock alerts, ...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Tasks run in parallel')
+        parser.add_argument('--batch-size', type=int, default=None, help='Tasks claimed at a time (default 2x concurrency)')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when nothing is due')
+        parser.add_argument('--once', action='store_true', help='Run everything that is due and exit')
+
+    def handle(self, *args, **options):
+        queue.discover()
+        concurrency = options['concurrency']
+        batch_size = options['batch_size'] or concurrency * 2
+        succeeded = failed = 0
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='task') as pool:
+            try:
+                while True:
+                    batch = queue.claim_batch(batch_size)
+                    if batch:
+                        for ok in pool.map(run_task, batch):
+                            succeeded += ok
+                            failed += not ok
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+            except KeyboardInterrupt:
+                pass
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Ran {succeeded + failed} tasks ({failed} failed) in {elapsed:.1f}s'
+        ))
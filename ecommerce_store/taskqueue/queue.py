@@ -0,0 +1,146 @@
+"""
+Database-backed task queue.
+
+Functions decorated with @task are registered by name. `fn.delay(**kwargs)`
+inserts one Task row once the surrounding transaction commits, so a rolled
+back request never leaves work behind and the request itself only pays for
+that insert. `manage.py run_worker` claims due rows, runs them on a thread
+pool and retries failures with exponential backoff until max_attempts.
+Every claim uses up an attempt, so a task whose worker keeps dying before
+recording an outcome is eventually failed too instead of reclaimed forever.
+
+Task modules are found by importing `<app>.tasks` for every installed app.
+Keyword arguments must be JSON serialisable.
+"""
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 60 * 60
+STALE_RUNNING_SECONDS = 600
+
+registry = {}
+
+
+def task(name=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register a function as a task and give it a .delay(**kwargs)"""
+    def decorator(fn):
+        task_name = name or f'{fn.__module__}.{fn.__name__}'
+        registry[task_name] = fn
+        fn.task_name = task_name
+        fn.max_attempts = max_attempts
+        fn.delay = lambda **kwargs: enqueue(task_name, max_attempts=max_attempts, **kwargs)
+        return fn
+    return decorator
+
+
+def enqueue(name, max_attempts=DEFAULT_MAX_ATTEMPTS, **kwargs):
+    """Queue a task to run after the current transaction commits"""
+    transaction.on_commit(lambda: Task.objects.create(
+        name=name, kwargs=kwargs, max_attempts=max_attempts, run_at=timezone.now(),
+    ))
+
+
+def enqueue_many(calls):
+    """Queue [(task function, kwargs)] with a single insert after commit"""
+    def insert():
+        now = timezone.now()
+        Task.objects.bulk_create([
+            Task(name=fn.task_name, kwargs=kwargs, max_attempts=fn.max_attempts, run_at=now)
+            for fn, kwargs in calls
+        ])
+    transaction.on_commit(insert)
+
+
+def discover():
+    autodiscover_modules('tasks')
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt: doubling, capped, jittered"""
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def fail_abandoned(stale):
+    """
+    Fail running tasks whose claim went stale with no attempts left: their
+    worker died (or hung) on every attempt, so running them again would only
+    take down another one.
+    """
+    abandoned = Task.objects.filter(status='running', claimed_at__lt=stale, attempts__gte=F('max_attempts'))
+    failed = abandoned.update(
+        status='failed', last_error='Worker stopped responding on every attempt',
+        claimed_by='', claimed_at=None, updated_at=timezone.now(),
+    )
+    if failed:
+        logger.error(f"{failed} task(s) failed permanently: worker stopped responding on every attempt")
+
+
+def claim_batch(limit, worker_id=None):
+    """
+    Atomically mark up to `limit` due tasks as running for this worker. Every
+    claim, including reclaiming a stale one, counts as an attempt.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=STALE_RUNNING_SECONDS)
+    fail_abandoned(stale)
+    runnable = Q(status='pending', run_at__lte=now) | Q(status='running', claimed_at__lt=stale)
+    ids = list(Task.objects.filter(runnable).order_by('run_at').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    # The runnable re-check makes the claim safe against concurrent workers;
+    # the claim token tells this worker which rows it actually won
+    token = worker_id or uuid.uuid4().hex
+    Task.objects.filter(runnable, id__in=ids).update(
+        status='running', claimed_by=token, claimed_at=now, attempts=F('attempts') + 1,
+    )
+    return list(Task.objects.filter(id__in=ids, status='running', claimed_by=token).order_by('run_at'))
+
+
+def run(task_row):
+    """Run one claimed task and record the outcome. Returns True on success."""
+    fn = registry.get(task_row.name)
+    # Counted when the task was claimed
+    attempts = task_row.attempts
+    try:
+        if fn is None:
+            raise LookupError(f'Unknown task {task_row.name!r}')
+        fn(**task_row.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if attempts < task_row.max_attempts:
+            status, run_at = 'pending', timezone.now() + timedelta(seconds=backoff(attempts))
+            logger.warning(f"Task {task_row.name} #{task_row.id} failed (attempt {attempts}), retrying")
+        else:
+            status, run_at = 'failed', task_row.run_at
+            logger.error(f"Task {task_row.name} #{task_row.id} failed permanently:\n{error}")
+        record(task_row, status=status, run_at=run_at, last_error=error)
+        return False
+    record(task_row, status='done', last_error='')
+    return True
+
+
+def record(task_row, **outcome):
+    """
+    Store a run's outcome, unless the task was reclaimed as stale meanwhile:
+    only the worker holding the current claim token may write to the row.
+    """
+    updated = Task.objects.filter(id=task_row.id, status='running', claimed_by=task_row.claimed_by).update(
+        claimed_by='', claimed_at=None, updated_at=timezone.now(), **outcome,
+    )
+    if not updated:
+        logger.warning(f"Task {task_row.name} #{task_row.id} was reclaimed by another worker; outcome dropped")
@@ -0,0 +1,140 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from . import queue
+from .models import Task
+
+calls = []
+
+
+@queue.task(name='tests.record', max_attempts=3)
+def record(value):
+    calls.append(value)
+
+
+@queue.task(name='tests.explode', max_attempts=2)
+def explode():
+    raise RuntimeError('boom')
+
+
+class EnqueueTests(TestCase):
+
+    def test_task_is_inserted_once_the_transaction_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record.delay(value=1)
+            self.assertFalse(Task.objects.exists())
+        task = Task.objects.get()
+        self.assertEqual((task.name, task.kwargs, task.max_attempts), ('tests.record', {'value': 1}, 3))
+
+    def test_rolled_back_work_leaves_no_task(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ZeroDivisionError), transaction.atomic():
+                queue.enqueue_many([(record, {'value': 1}), (record, {'value': 2})])
+                1 / 0
+        self.assertFalse(Task.objects.exists())
+
+
+class RunTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def claim(self, name, **kwargs):
+        Task.objects.create(name=name, kwargs=kwargs, max_attempts=queue.registry[name].max_attempts,
+                            run_at=timezone.now())
+        task, = queue.claim_batch(10)
+        return task
+
+    def test_success_is_recorded(self):
+        self.assertTrue(queue.run(self.claim('tests.record', value=7)))
+        self.assertEqual(calls, [7])
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, task.claimed_by), ('done', 1, ''))
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        before = timezone.now()
+        with self.assertLogs('taskqueue.queue', 'WARNING'):
+            self.assertFalse(queue.run(self.claim('tests.explode')))
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), ('pending', 1))
+        self.assertIn('RuntimeError: boom', task.last_error)
+        # 10s for the first retry, give or take the jitter
+        self.assertGreaterEqual(task.run_at, before + timedelta(seconds=8))
+        self.assertLessEqual(task.run_at, timezone.now() + timedelta(seconds=12))
+        self.assertEqual(queue.claim_batch(10), [])
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('taskqueue.queue', 'ERROR'):
+            queue.run(queue.claim_batch(10)[0])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('failed', 2))
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        with mock.patch('random.uniform', return_value=1.0):
+            self.assertEqual([queue.backoff(n) for n in (1, 2, 3)], [10, 20, 40])
+            self.assertEqual(queue.backoff(50), queue.BACKOFF_MAX_SECONDS)
+
+    def test_stale_tasks_are_reclaimed_and_the_old_claim_cannot_finish_them(self):
+        stale = self.claim('tests.record', value=1)
+        Task.objects.update(claimed_at=timezone.now() - timedelta(seconds=queue.STALE_RUNNING_SECONDS + 1))
+
+        reclaimed, = queue.claim_batch(10, worker_id='second')
+        self.assertEqual(reclaimed.pk, stale.pk)
+
+        # The first worker wakes up and finishes: its outcome is dropped
+        with self.assertLogs('taskqueue.queue', 'WARNING'):
+            queue.run(stale)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.claimed_by), ('running', 'second'))
+        queue.run(reclaimed)
+        task.refresh_from_db()
+        # The lost first run counts as an attempt
+        self.assertEqual((task.status, task.attempts), ('done', 2))
+
+    def test_task_that_keeps_killing_its_worker_ends_up_failed(self):
+        self.claim('tests.record', value=1)
+        for attempt in range(2, 4):
+            # The worker died: the claim goes stale and another worker takes it
+            Task.objects.update(claimed_at=timezone.now() - timedelta(seconds=queue.STALE_RUNNING_SECONDS + 1))
+            task, = queue.claim_batch(10)
+            self.assertEqual(task.attempts, attempt)
+
+        Task.objects.update(claimed_at=timezone.now() - timedelta(seconds=queue.STALE_RUNNING_SECONDS + 1))
+        with self.assertLogs('taskqueue.queue', 'ERROR'):
+            self.assertEqual(queue.claim_batch(10), [])
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, task.claimed_by), ('failed', 3, ''))
+        self.assertEqual(calls, [])
+
+
+class RunWorkerTests(TransactionTestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_worker_survives_errors_outside_the_task(self):
+        for value in range(3):
+            Task.objects.create(name='tests.record', kwargs={'value': value}, run_at=timezone.now())
+        real_run = queue.run
+
+        def run(task_row):
+            if task_row.kwargs['value'] == 1:
+                raise ConnectionError('database went away')
+            return real_run(task_row)
+
+        out = StringIO()
+        with mock.patch.object(queue, 'run', side_effect=run), self.assertLogs('taskqueue', 'ERROR'):
+            # The task whose outcome couldn't be recorded stays claimed, so
+            # --once drains the other two and exits
+            call_command('run_worker', '--once', '--concurrency', '2', stdout=out)
+        self.assertIn('Ran 3 tasks (1 failed)', out.getvalue())
+        self.assertEqual(sorted(calls), [0, 2])
+        self.assertEqual(
+            dict(Task.objects.values_list('kwargs__value', 'status')), {0: 'done', 1: 'running', 2: 'done'},
+        )